@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+from decimal import Decimal, getcontext
+from BondCalc import BondCalc
+
+
+getcontext().prec = 50
+
+
+class BondBench:
+    '''
+    ## BondBench
+    ### BondCalc 的數值準確度回歸測試與效能基準：將 price、ytm、interest_rate、current_y、horizon_ytm 與封閉解或高精度（Decimal）參考值比對，並量測單筆與大量（1 萬～100 萬檔）債券的耗時。
+
+    ### 方法：
+    - accuracy: 以隨機債券比對各方法與參考值的誤差。
+    - bulk: 量測逐筆呼叫 BondCalc 與 NumPy 向量化參考實作的耗時。
+    - ref_price / ref_flat_price / ref_par_yield / ref_spot / ref_horizon: 參考值。
+    - vec_price / vec_ytm: 向量化實作（與 BondCalc 相同的公式與二分法）。
+
+    ### 例子：
+    python BondBench.py --cases 500 --sizes 10000 100000 1000000 --scalar-limit 5000
+    '''
+
+    def __init__(self, seed=0, tolerance=1e-6):
+        '''
+        - seed: int, 隨機債券的種子
+        - tolerance: float, 二分法求解的容忍誤差（BondCalc 使用 1e-6）
+        '''
+        self.rng = np.random.default_rng(seed)
+        self.tolerance = tolerance
+        self.bc = BondCalc()
+
+
+    def bonds(self, size):
+        '''
+        ### 產生隨機債券：年數、每年付息次數、票面利率、殖利率
+        '''
+        return pd.DataFrame({
+            'year': self.rng.integers(1, 31, size),
+            'n': self.rng.choice([1, 2, 4], size),
+            'coupon': self.rng.uniform(0.0, 0.1, size).round(4),
+            'rate': self.rng.uniform(0.005, 0.1, size).round(6),
+        })
+
+
+    def curve(self, periods):
+        # 向上傾斜的即期利率曲線
+        return list(np.sort(self.rng.uniform(0.005, 0.08, periods)))
+
+
+    # ---------- 參考值 ----------
+
+    @staticmethod
+    def ref_price(rs, y, n=1, p=100):
+        '''
+        ### 以 Decimal 計算與 BondCalc.price 相同定義的現值
+        '''
+        n, p, y = Decimal(n), Decimal(str(p)), Decimal(str(y))
+        discounts = [(1 + Decimal(str(r)) / n) ** -t for t, r in enumerate(rs, start=1)]
+        return float(sum(p * y / n * d for d in discounts) + p * discounts[-1])
+
+
+    @staticmethod
+    def ref_flat_price(coupon, year, n, y, p=100):
+        '''
+        ### 平坦殖利率下的封閉解（年金現值 + 面值現值）
+        '''
+        i = np.asarray(y) / n
+        periods = np.asarray(year) * n
+        annuity = (1 - (1 + i) ** -periods) / i
+        return p * np.asarray(coupon) / n * annuity + p * (1 + i) ** -periods
+
+
+    @staticmethod
+    def ref_par_yield(rs, n=1):
+        '''
+        ### 平價債券殖利率：y = n(1 - d_N) / Σd_t
+        '''
+        discounts = [(1 + Decimal(str(r)) / n) ** -t for t, r in enumerate(rs, start=1)]
+        return float(n * (1 - discounts[-1]) / sum(discounts))
+
+
+    @staticmethod
+    def ref_spot(rs, y, n=1):
+        '''
+        ### 反推最後一期即期利率的封閉解
+        '''
+        periods = len(rs) + 1
+        c = Decimal(100) * Decimal(str(y)) / n
+        pv = sum(c * (1 + Decimal(str(r)) / n) ** -t for t, r in enumerate(rs, start=1))
+        return float(n * (((c + 100) / (100 - pv)) ** (Decimal(1) / periods) - 1))
+
+
+    @staticmethod
+    def ref_horizon(f, horizon, y, p=100, p_buy=100):
+        '''
+        ### 平坦遠期利率下的投資期限報酬率：債息以 f 再投資，期末以 p(1+y)/(1+f) 賣出
+        '''
+        coupons = p * y * ((1 + f) ** horizon - 1) / f
+        p_sell = p * (1 + y) / (1 + f)
+        return ((p_sell + coupons) / p_buy) ** (1 / horizon) - 1
+
+
+    # ---------- 向量化實作 ----------
+
+    @staticmethod
+    def vec_price(coupon, year, n, y, p=100):
+        return BondBench.ref_flat_price(coupon, year, n, y, p)
+
+
+    def vec_ytm(self, coupon, year, n, p_buy, p=100):
+        '''
+        ### 與 BondCalc.ytm 相同的二分法，對所有債券同時迭代
+        '''
+        left = np.zeros(len(p_buy))
+        right = np.ones(len(p_buy))
+        while np.max(right - left) > self.tolerance:
+            mid = (left + right) / 2
+            below = self.vec_price(coupon, year, n, mid, p) < p_buy
+            right = np.where(below, mid, right)
+            left = np.where(below, left, mid)
+        return (left + right) / 2
+
+
+    # ---------- 測試 ----------
+
+    def accuracy(self, cases=200):
+        '''
+        ### 比對各方法與參考值，回傳每個方法的最大誤差與是否通過
+        '''
+        errors = {name: [] for name in ['price', 'price_flat', 'ytm', 'current_y', 'interest_rate', 'horizon_ytm']}
+        bonds = self.bonds(cases)
+
+        with self._quiet():
+            for bond in bonds.itertuples():
+                periods = bond.year * bond.n
+                rs = self.curve(periods)
+                errors['price'].append(abs(self.bc.price(rs, bond.coupon, bond.n, print_p=False) - self.ref_price(rs, bond.coupon, bond.n)))
+
+                flat = [bond.rate] * periods
+                errors['price_flat'].append(abs(self.bc.price(flat, bond.coupon, bond.n, print_p=False)
+                                                - self.ref_flat_price(bond.coupon, bond.year, bond.n, bond.rate)))
+
+                # 以已知殖利率的封閉解價格回推 YTM
+                p_buy = float(self.ref_flat_price(bond.coupon, bond.year, bond.n, bond.rate))
+                errors['ytm'].append(abs(self.bc.ytm(bond.coupon, bond.year, bond.n, p_buy, 100) - bond.rate))
+
+                errors['current_y'].append(abs(self.bc.current_y(rs, bond.n) - self.ref_par_yield(rs, bond.n)))
+
+                spot_rs = rs[:-1]
+                par = self.ref_par_yield(rs, bond.n)
+                errors['interest_rate'].append(abs(self.bc.interest_rate(spot_rs, par, bond.n) - self.ref_spot(spot_rs, par, bond.n)))
+
+                horizon = min(bond.year, 10)
+                f = rs[0]
+                errors['horizon_ytm'].append(abs(self.bc.horizon_ytm([f] * horizon, horizon, bond.coupon, 100, p_buy, rs_to_fs=False)
+                                                 - self.ref_horizon(f, horizon, bond.coupon, 100, p_buy)))
+
+        # 現值為直接計算，只允許浮點誤差；其餘為二分法，允許 tolerance
+        limits = {'price': 1e-9, 'price_flat': 1e-9}
+        rows = []
+        for name, values in errors.items():
+            limit = limits.get(name, self.tolerance)
+            rows.append({'方法': name, '筆數': len(values), '最大誤差': max(values), '平均誤差': float(np.mean(values)),
+                         '容忍誤差': limit, '通過': max(values) <= limit})
+        return pd.DataFrame(rows)
+
+
+    def bulk(self, sizes=(10_000, 100_000, 1_000_000), scalar_limit=10_000):
+        '''
+        ### 量測大量債券的耗時；逐筆呼叫超過 scalar_limit 時以抽樣推估總耗時
+        '''
+        rows = []
+        for size in sizes:
+            bonds = self.bonds(size)
+            coupon, year, n, y = (bonds[col].to_numpy() for col in ['coupon', 'year', 'n', 'rate'])
+            sample = min(size, scalar_limit)
+
+            start = time.perf_counter()
+            prices = self.vec_price(coupon, year, n, y)
+            vec_price_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with self._quiet():
+                scalar_prices = [self.bc.price([y[i]] * (year[i] * n[i]), coupon[i], n[i], print_p=False) for i in range(sample)]
+            scalar_price_time = (time.perf_counter() - start) * size / sample
+
+            start = time.perf_counter()
+            ytms = self.vec_ytm(coupon, year, n, prices)
+            vec_ytm_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with self._quiet():
+                scalar_ytms = [self.bc.ytm(coupon[i], year[i], n[i], prices[i], 100) for i in range(sample)]
+            scalar_ytm_time = (time.perf_counter() - start) * size / sample
+
+            rows.append({'方法': 'price', '筆數': size, '逐筆(秒)': scalar_price_time, '向量化(秒)': vec_price_time,
+                         '倍數': scalar_price_time / vec_price_time, '推估': sample < size,
+                         '最大差異': float(np.max(np.abs(np.array(scalar_prices) - prices[:sample])))})
+            rows.append({'方法': 'ytm', '筆數': size, '逐筆(秒)': scalar_ytm_time, '向量化(秒)': vec_ytm_time,
+                         '倍數': scalar_ytm_time / vec_ytm_time, '推估': sample < size,
+                         '最大差異': float(np.max(np.abs(np.array(scalar_ytms) - ytms[:sample])))})
+        return pd.DataFrame(rows)
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _quiet():
+        # BondCalc 的方法會印出結果，量測時關閉輸出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='BondCalc 準確度與效能基準')
+    parser.add_argument('--cases', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--scalar-limit', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-bulk', action='store_true')
+    args = parser.parse_args()
+
+    bond_bench = BondBench(seed=args.seed)
+    accuracy_df = bond_bench.accuracy(args.cases)
+    print(accuracy_df.to_string(index=False))
+
+    if not args.skip_bulk:
+        print(bond_bench.bulk(args.sizes, args.scalar_limit).to_string(index=False))
+
+    sys.exit(0 if accuracy_df['通過'].all() else 1)
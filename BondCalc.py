@@ -241,7 +241,7 @@ if __name__=="__main__":
 
     bond_calc = BondCalc()
     # 零息利率
-    r_n_bisection = BondCalc.zero_price(0.0667, 6, 2)
+    r_n_bisection = bond_calc.zero_price(0.0667, 6, 2)
 
     # 遠期利率
     y = bond_calc.forward_rate(0.044, 3, 0.0415, 2)
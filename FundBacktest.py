@@ -0,0 +1,202 @@
+import itertools
+import numpy as np
+import pandas as pd
+from FundDownloader import FundDownloader
+
+
+class FundBacktest:
+    '''
+    ## FundBacktest
+    ### 基金輪動策略的參數網格回測：以 get_statistics 的漲跌矩陣，同時計算多組回顧天數、持有天數、持有檔數的績效，並考慮申購與贖回的時間差。
+
+    ### 方法：
+    - scores: 以累積和計算所有日期的動能或低波動分數。
+    - simulate: 一組 (策略, 回顧天數, 持有天數) 下所有持有檔數的每日報酬。
+    - run: 回測整個參數網格，回傳每組參數的績效。
+    - equity: 單一組參數的淨值走勢。
+
+    ### 假設：
+    - 每 hold 天於訊號日收盤後依分數選出前 top_n 檔，等權重買進後持有不再平衡。
+    - 舊組合繼續持有 redemption_lag 天（贖回淨值日），資金閒置 subscription_lag 天後新組合才開始計算報酬。
+    - 手續費 fee 依換手比例在新組合第一天扣除；缺值的漲跌視為 0，符合資格的基金不足 top_n 檔時以現金補足。
+    - 所有參數組合使用相同的回測期間（最長回顧天數之後）。
+
+    ### 例子：
+    result_df = FundDownloader().run_range("20230520", "20240520")
+    fund_backtest = FundBacktest(lookbacks=(20, 60), holds=(10, 20), top_ns=(5, 10, 20))
+    grid_df = fund_backtest.run(result_df)
+    equity_df = fund_backtest.equity(result_df, 'momentum', 60, 20, 10)
+    '''
+
+    available_strategies = ('momentum', 'low_vol')
+
+
+    def __init__(self, strategies=('momentum', 'low_vol'), lookbacks=(20, 60, 120), holds=(5, 20, 60), top_ns=(5, 10, 20),
+                 redemption_lag=1, subscription_lag=4, fee=0.0, risk_free=0.0, min_coverage=0.8, periods_per_year=252):
+        '''
+        - strategies: tuple[str], momentum（回顧期間累積報酬）/ low_vol（回顧期間波動度越低越好）
+        - lookbacks: tuple[int], 回顧天數
+        - holds: tuple[int], 持有天數（調整間隔），須大於 subscription_lag
+        - top_ns: tuple[int], 持有檔數
+        - redemption_lag: int, 訊號日後舊組合繼續持有的天數
+        - subscription_lag: int, 贖回後資金閒置的天數
+        - fee: float, 換手時的手續費率
+        - risk_free: float, 年化無風險利率（夏普比率用）
+        - min_coverage: float, 回顧期間有漲跌資料的比例低於此值的基金不列入選擇
+        - periods_per_year: int, 年化時每年的交易日數
+        '''
+        unknown = set(strategies) - set(self.available_strategies)
+        if unknown:
+            raise ValueError(f'不支援的策略: {unknown}，可用 {self.available_strategies}')
+        if min(holds) <= subscription_lag:
+            raise ValueError('持有天數必須大於 subscription_lag')
+        self.strategies = tuple(strategies)
+        self.lookbacks = tuple(lookbacks)
+        self.holds = tuple(holds)
+        self.top_ns = tuple(sorted(top_ns))
+        self.redemption_lag = redemption_lag
+        self.subscription_lag = subscription_lag
+        self.fee = fee
+        self.risk_free = risk_free
+        self.min_coverage = min_coverage
+        self.periods_per_year = periods_per_year
+
+
+    def prepare(self, result_df):
+        '''
+        ### 回傳 (日期, 漲跌小數矩陣（缺值為 0）, 有效資料的累積筆數, 漲跌累積和, 平方累積和, 對數報酬累積和)
+        '''
+        returns = FundDownloader.return_matrix(result_df)
+        values = returns.to_numpy(dtype=float) / 100
+        valid = ~np.isnan(values)
+        r = np.where(valid, values, 0.0)
+        pad = lambda x: np.concatenate([np.zeros((len(x), 1)), np.cumsum(x, axis=1)], axis=1)
+        return returns.columns, r, pad(valid), pad(r), pad(r * r), pad(np.log1p(r))
+
+
+    def scores(self, prepared, strategy, lookback):
+        '''
+        ### 每個日期（含當日）往前 lookback 天的分數，分數越高越優先；資料不足為 -inf
+        '''
+        _, r, count, total, square, log_total = prepared
+        window = lambda c: c[:, lookback:] - c[:, :-lookback]
+        n = window(count)
+        if strategy == 'momentum':
+            score = window(log_total)
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                variance = (window(square) - window(total) ** 2 / n) / (n - 1)
+            score = -np.sqrt(np.maximum(variance, 0))
+        score = np.where(n >= self.min_coverage * lookback, score, -np.inf)
+        # 前 lookback - 1 天沒有完整的回顧期間
+        return np.concatenate([np.full((len(r), lookback - 1), -np.inf), score], axis=1)
+
+
+    def simulate(self, prepared, strategy, lookback, hold):
+        '''
+        ### 回傳 (每日報酬 (持有檔數 × 日期), 每次調整的換手率 (調整次數 × 持有檔數))
+        '''
+        _, r, *_ = prepared
+        funds, days = r.shape
+        k_max = min(self.top_ns[-1], funds)
+        top_ns = np.minimum(self.top_ns, k_max)
+
+        # 訊號日與每個組合開始計算報酬的日期
+        start = max(self.lookbacks) - 1
+        signals = np.arange(start, days - 1, hold)
+        first = signals + self.redemption_lag + self.subscription_lag + 1
+
+        # 每個訊號日依分數取前 k_max 檔，由高到低排序
+        score = self.scores(prepared, strategy, lookback)[:, signals].T  # (調整次數 × 基金)
+        top = np.argpartition(-score, k_max - 1, axis=1)[:, :k_max]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(score, top, axis=1), axis=1, kind='stable'), axis=1)
+        cash = np.isinf(np.take_along_axis(score, top, axis=1))
+
+        # 持有期間的每日毛報酬 (調整次數 × 名次 × 天)，買進持有的組合淨值為前 K 名累積報酬的平均
+        day = first[:, None] + np.arange(hold - self.subscription_lag)
+        inside = day < days
+        gross = 1 + r[top[:, :, None], np.minimum(day, days - 1)[:, None, :]]
+        gross[~np.broadcast_to(inside[:, None, :], gross.shape)] = 1
+        gross[cash] = 1
+        value = np.cumsum(np.cumprod(gross, axis=2), axis=1)[:, top_ns - 1, :] / top_ns[None, :, None]
+        previous = np.concatenate([np.ones(value.shape[:2] + (1,)), value[:, :, :-1]], axis=2)
+        daily_return = value / previous - 1
+
+        turnover = self.turnover(top, funds, top_ns)
+        daily_return[:, :, 0] = (1 + daily_return[:, :, 0]) * (1 - self.fee * turnover) - 1
+
+        # 各組合的持有期間互不重疊，直接放回日期軸；閒置與回測前的日期報酬為 0
+        daily = np.zeros((len(top_ns), days))
+        daily[:, day[inside]] = daily_return.transpose(1, 0, 2)[:, inside]
+        return daily[:, start + 1:], turnover
+
+
+    @staticmethod
+    def turnover(top, funds, top_ns):
+        '''
+        ### 以名次計算前後兩期前 K 名的重疊檔數，換手率 = 1 - 重疊 / K（第一期為 1）
+        '''
+        periods, k_max = top.shape
+        rank = np.full((periods, funds), k_max)
+        np.put_along_axis(rank, top, np.arange(k_max)[None, :].repeat(periods, axis=0), axis=1)
+        both = np.maximum(rank[1:], rank[:-1])
+        row, col = np.nonzero(both < k_max)
+        overlap = np.bincount(row * k_max + both[row, col], minlength=(periods - 1) * k_max).reshape(periods - 1, k_max)
+        overlap = np.cumsum(overlap, axis=1)[:, top_ns - 1]
+        return np.vstack([np.ones((1, len(top_ns))), 1 - overlap / top_ns])
+
+
+    def statistics(self, daily):
+        '''
+        ### 每列每日報酬的總報酬、年化報酬、年化波動、夏普比率、最大回撤
+        '''
+        value = np.cumprod(1 + daily, axis=1)
+        total = value[:, -1] - 1
+        years = daily.shape[1] / self.periods_per_year
+        volatility = daily.std(axis=1, ddof=1) * np.sqrt(self.periods_per_year)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sharpe = (daily.mean(axis=1) * self.periods_per_year - self.risk_free) / volatility
+        drawdown = (value / np.maximum.accumulate(np.maximum(value, 1), axis=1) - 1).min(axis=1)
+        return pd.DataFrame({
+            '總報酬': total,
+            '年化報酬': (1 + total) ** (1 / years) - 1,
+            '年化波動': volatility,
+            '夏普比率': sharpe,
+            '最大回撤': np.minimum(drawdown, 0),
+        })
+
+
+    def run(self, result_df):
+        '''
+        ### 回測整個參數網格，依夏普比率由高到低排序
+        '''
+        prepared = self.prepare(result_df)
+        if prepared[1].shape[1] <= max(self.lookbacks) + self.redemption_lag + self.subscription_lag + 1:
+            raise ValueError('資料天數不足以涵蓋回顧天數與申購贖回時間差')
+
+        frames = []
+        for strategy, lookback, hold in itertools.product(self.strategies, self.lookbacks, self.holds):
+            daily, turnover = self.simulate(prepared, strategy, lookback, hold)
+            stats_df = self.statistics(daily)
+            stats_df.insert(0, '策略', strategy)
+            stats_df.insert(1, '回顧天數', lookback)
+            stats_df.insert(2, '持有天數', hold)
+            stats_df.insert(3, '持有檔數', self.top_ns)
+            stats_df['調整次數'] = len(turnover)
+            stats_df['平均換手率'] = turnover.mean(axis=0)
+            frames.append(stats_df)
+
+        grid_df = pd.concat(frames, ignore_index=True)
+        return grid_df.sort_values('夏普比率', ascending=False, ignore_index=True)
+
+
+    def equity(self, result_df, strategy, lookback, hold, top_n):
+        '''
+        ### 單一組參數的每日報酬與淨值（起始為 1）
+        '''
+        backtest = FundBacktest([strategy], self.lookbacks, [hold], [top_n], self.redemption_lag, self.subscription_lag,
+                                self.fee, self.risk_free, self.min_coverage, self.periods_per_year)
+        prepared = backtest.prepare(result_df)
+        daily, _ = backtest.simulate(prepared, strategy, lookback, hold)
+        dates = prepared[0][-daily.shape[1]:]
+        return pd.DataFrame({'漲跌': daily[0], '淨值': np.cumprod(1 + daily[0])}, index=dates)
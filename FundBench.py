@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import zlib
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import contextlib
+import urllib.request
+import multiprocessing
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from FundRate import FundRate
+from FundMetrics import FundMetrics
+from FundDownloader import FundDownloader
+
+
+class SitcaStandIn:
+    '''
+    ## SitcaStandIn
+    ### 本機的 SITCA 替身伺服器：回放錄製的頁面或產生合成的 IN2106 / IN2105 / IN2213 頁面，包含 ASP.NET 表單請求碼，可注入延遲與失敗。
+
+    ### 方法：
+    - start: 在獨立子行程啟動伺服器並回傳網址（不與受測程式爭用 GIL）。
+    - stats: 取得伺服器端的請求數與注入失敗數。
+    - stop: 關閉伺服器。
+
+    ### 錄製頁面：
+    replay_dir 中若有 {頁面}_{查詢值}.html（例如 IN2106_20240102.html、IN2213_202401.html、IN2105_basic.html），
+    則直接回放該檔案，否則產生合成頁面。
+    '''
+
+    token_fields = ['__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION']
+
+
+    def __init__(self, funds=1000, latency=0.0, jitter=0.0, failure_rate=0.0, dividend_ratio=0.2, replay_dir=None, seed=0):
+        '''
+        - funds: int, 合成基金數量
+        - latency: float, 每個請求的固定延遲（秒）
+        - jitter: float, 額外的隨機延遲上限（秒）
+        - failure_rate: float, 資料請求直接斷線的機率
+        - dividend_ratio: float, 每月有配息的基金比例
+        - replay_dir: str, 錄製頁面所在資料夾
+        '''
+        self.funds = funds
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.dividend_ratio = dividend_ratio
+        self.replay_dir = replay_dir
+        self.rng = np.random.default_rng(seed)
+        self.token = f'{seed:08x}'
+
+        types = list(FundDownloader().fund_types)
+        self.codes = [f'A{i:05d}' for i in range(funds)]
+        self.types = [types[i % len(types)] for i in range(funds)]
+        self.requests = 0
+        self.failures = 0
+
+
+    def start(self, host='127.0.0.1', port=0):
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=self.serve, args=(host, port, sender), daemon=True)
+        self.process.start()
+        self.port = receiver.recv()
+        self.url = f'http://{host}:{self.port}'
+        return self.url
+
+
+    def serve(self, host, port, sender):
+        # 注入的斷線會被 aiohttp 記錄成錯誤，基準測試時不需要
+        logging.getLogger('aiohttp.server').setLevel(logging.CRITICAL)
+
+        async def main():
+            app = web.Application()
+            app.router.add_get('/stats', self.handle_stats)
+            app.router.add_route('*', '/ROC/Industry/{page}.aspx', self.handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            sender.send(site._server.sockets[0].getsockname()[1])
+            await asyncio.Event().wait()
+
+        asyncio.run(main())
+
+
+    def stats(self):
+        with urllib.request.urlopen(f'{self.url}/stats') as response:
+            return json.loads(response.read())
+
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+    async def handle_stats(self, request):
+        return web.json_response({'requests': self.requests, 'failures': self.failures})
+
+
+    async def handle(self, request):
+        self.requests += 1
+        page = request.match_info['page']
+        form = await request.post()
+        delay = self.latency + self.jitter * self.rng.random()
+        if delay:
+            await asyncio.sleep(delay)
+
+        # 未帶請求碼：回傳只有表單的頁面，對應 get_post 的握手
+        if form.get('__VIEWSTATE') != self.token:
+            return self._html(self._form())
+
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            self.failures += 1
+            request.transport.close()
+            raise ConnectionResetError('injected failure')
+
+        if page == 'IN2106':
+            key = form.get('ctl00$ContentPlaceHolder1$txtQ_Date', '')
+            body = self._replay(page, key) or self._daily(key)
+        elif page == 'IN2105':
+            body = self._replay(page, 'basic') or self._basic()
+        elif page == 'IN2213':
+            key = form.get('ctl00$ContentPlaceHolder1$ddlQ_YM', '')
+            body = self._replay(page, key) or self._dividend(key)
+        else:
+            raise web.HTTPNotFound()
+        return self._html(self._form() + body)
+
+
+    def _html(self, body):
+        return web.Response(text=f'<html><body>{body}</body></html>', content_type='text/html', charset='utf-8')
+
+
+    def _form(self):
+        inputs = ''.join(f'<input type="hidden" name="{name}" value="{self.token}"/>' for name in self.token_fields)
+        return f'<form id="aspnetForm" method="post">{inputs}</form>'
+
+
+    def _replay(self, page, key):
+        if not self.replay_dir:
+            return None
+        path = os.path.join(self.replay_dir, f'{page}_{key}.html')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            return f.read()
+
+
+    def _rows(self, rows):
+        return ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>' for row in rows)
+
+
+    def _daily(self, date_str):
+        # 以日期為種子，同一天的合成資料固定
+        rng = np.random.default_rng(zlib.crc32(date_str.encode()))
+        changes = rng.normal(0, 1, self.funds).round(2)
+        header = '<tr><th>基金漲跌</th></tr><tr><th>欄位</th></tr>'
+        rows = [[i, '', '', '', code, '', '', '', '', change] for i, (code, change) in enumerate(zip(self.codes, changes))]
+        return f'<table>{header}{self._rows(rows)}</table>'
+
+
+    def _basic(self):
+        rows = [[type_code, code, '', '', f'合成基金{i}(新臺幣)', '', '', f'RR{i % 5 + 1}', '', '', '', '', 'TWD']
+                for i, (type_code, code) in enumerate(zip(self.types, self.codes))]
+        return f'<table>{self._rows(rows)}</table>'
+
+
+    def _dividend(self, ym):
+        rng = np.random.default_rng(zlib.crc32(ym.encode()))
+        payers = np.flatnonzero(rng.random(self.funds) < self.dividend_ratio)
+        header = '<tr><th>配息</th></tr><tr><th>欄位</th></tr>'
+        # parse_data 會再略過前兩筆資料列
+        rows = [['', '基金統編', '', '', '', '除息日', '', '股利率']] * 2
+        rows += [['', self.codes[i], '', '', '', f'{ym[:4]}/{ym[4:]}/15', '', round(rng.uniform(0.1, 1.0), 4)] for i in payers]
+        return f'<table>{header}{self._rows(rows)}</table>'
+
+
+class FundBench:
+    '''
+    ## FundBench
+    ### 離線的端到端基準測試：以 SitcaStandIn 取代 sitca.org.tw，量測 run_range、missing_data 與 FundRate.run 的吞吐量、延遲分位數、峰值記憶體與各階段耗時。
+
+    ### 指標說明：
+    - fetch_p50 / fetch_p99: fetch 階段的耗時分位數。解析與下載在同一個事件迴圈，耗時包含等待其他協程解析的時間，
+      是「事件迴圈負載下」的延遲，不是伺服器回應時間。
+    - peak_rss_mb: 情境子行程的峰值記憶體；不計時的前置步驟（missing_data 的既有檔案）在另一個子行程執行，不計入。
+
+    ### 例子：
+    python FundBench.py --funds 3000 --start 20240101 --end 20240331 --latency 0.05 --failure-rate 0.01
+    '''
+
+    scenarios = ('run_range', 'missing_data', 'rate')
+
+
+    def __init__(self, funds=1000, start_date="20240101", end_date="20240131", latency=0.0, jitter=0.0,
+                 failure_rate=0.0, replay_dir=None, quiet=True):
+        self.server_args = dict(funds=funds, latency=latency, jitter=jitter, failure_rate=failure_rate, replay_dir=replay_dir)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.quiet = quiet
+
+
+    def run(self, scenarios=None):
+        '''
+        ### 替身伺服器與每個情境各自在獨立子行程中執行，峰值記憶體互不影響
+        '''
+        results = []
+        server = SitcaStandIn(**self.server_args)
+        self.url = server.start()
+        context = multiprocessing.get_context('spawn')
+        try:
+            for scenario in scenarios or self.scenarios:
+                with tempfile.TemporaryDirectory(prefix='fund_bench_') as workdir:
+                    if hasattr(self, f'_setup_{scenario}'):
+                        with context.Pool(1) as pool:
+                            pool.apply(FundBench._setup_scenario, (self, scenario, workdir))
+                    failures = server.stats()['failures']
+                    with context.Pool(1) as pool:
+                        result = pool.apply(FundBench._run_scenario, (self, scenario, workdir))
+                result['injected_failures'] = server.stats()['failures'] - failures
+                results.append(result)
+                self.print_result(result)
+        finally:
+            server.stop()
+        return results
+
+
+    def point(self, downloader):
+        '''
+        ### 將 FundDownloader / FundRate 的網址改指向替身伺服器
+        '''
+        base = f'{self.url}/ROC/Industry'
+        if isinstance(downloader, FundDownloader):
+            downloader.data_url = f'{base}/IN2106.aspx?pid=IN2213_02'
+            downloader.basic_url = f'{base}/IN2105.aspx?pid=IN2212_02'
+        else:
+            downloader.rate_url = f'{base}/IN2213.aspx?pid=IN2222_03'
+        return downloader
+
+
+    @contextlib.contextmanager
+    def _workdir(self, workdir):
+        # 報表寫在暫存資料夾，並依 quiet 關閉下載過程的輸出
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if self.quiet else sys.stdout):
+                yield
+        finally:
+            os.chdir(cwd)
+
+
+    def _setup_scenario(self, scenario, workdir):
+        with self._workdir(workdir):
+            getattr(self, f'_setup_{scenario}')()
+
+
+    def _run_scenario(self, scenario, workdir):
+        metrics = FundMetrics(scenario, keep_samples=True)
+        with self._workdir(workdir):
+            elapsed = getattr(self, f'_bench_{scenario}')(metrics)
+
+        snapshot = metrics.snapshot()
+        requests = snapshot['counters'].get('requests', 0)
+        fetch = snapshot['stages'].get('fetch', {})
+        return {
+            'scenario': scenario,
+            'funds': self.server_args['funds'],
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'seconds': round(elapsed, 4),
+            'requests': requests,
+            'throughput': round(requests / elapsed, 2) if elapsed else None,
+            'fetch_p50': fetch.get('p50'),
+            'fetch_p99': fetch.get('p99'),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'stages': {stage: info['sum'] for stage, info in snapshot['stages'].items()},
+            'counters': snapshot['counters'],
+        }
+
+
+    def _bench_run_range(self, metrics):
+        fund_downloader = self.point(FundDownloader(metrics=metrics))
+        start = time.perf_counter()
+        fund_downloader.run_range(self.start_date, self.end_date, to_excel=True)
+        return time.perf_counter() - start
+
+
+    def _middle(self):
+        dates = pd.date_range(self.start_date, self.end_date, freq='B')
+        return dates[len(dates) // 2].strftime('%Y%m%d')
+
+
+    def _setup_missing_data(self):
+        # 先下載前半段作為既有檔案（不計時，在另一個子行程執行）
+        self.point(FundDownloader()).run_range(self.start_date, self._middle(), to_excel=True)
+
+
+    def _bench_missing_data(self, metrics):
+        # 量測補齊後半段
+        middle = self._middle()
+        fund_downloader = self.point(FundDownloader(metrics=metrics))
+        start = time.perf_counter()
+        fund_downloader.missing_data(f'{self.start_date}-{middle}基金資料', self.start_date, self.end_date)
+        return time.perf_counter() - start
+
+
+    def _bench_rate(self, metrics):
+        fund_rate = self.point(FundRate(metrics=metrics))
+        start = time.perf_counter()
+        fund_rate.run(self.start_date, self.end_date)
+        return time.perf_counter() - start
+
+
+    @staticmethod
+    def print_result(result):
+        p50 = f"{result['fetch_p50']:.4f}" if result['fetch_p50'] is not None else '-'
+        p99 = f"{result['fetch_p99']:.4f}" if result['fetch_p99'] is not None else '-'
+        print(f"[{result['scenario']}] 基金:{result['funds']}  耗時:{result['seconds']}秒  請求:{result['requests']}  "
+              f"吞吐量:{result['throughput']}筆/秒  fetch p50:{p50}  p99:{p99}（含事件迴圈負載）  峰值記憶體:{result['peak_rss_mb']}MB  "
+              f"注入失敗:{result['injected_failures']}")
+        print('  ' + '  '.join(f'{stage}:{seconds:.4f}秒' for stage, seconds in result['stages'].items()))
+
+
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='基金下載流程離線基準測試')
+    parser.add_argument('--funds', type=int, default=1000)
+    parser.add_argument('--start', default='20240101')
+    parser.add_argument('--end', default='20240131')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--replay-dir')
+    parser.add_argument('--scenarios', nargs='+', choices=FundBench.scenarios)
+    parser.add_argument('--output', help='將結果寫成 JSON')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    bench = FundBench(args.funds, args.start, args.end, args.latency, args.jitter,
+                      args.failure_rate, args.replay_dir, quiet=not args.verbose)
+    results = bench.run(args.scenarios)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'結果已保存到 {args.output}')
@@ -0,0 +1,184 @@
+import warnings
+import numpy as np
+import pandas as pd
+from FundDownloader import FundDownloader
+
+
+class FundCluster:
+    '''
+    ## FundCluster
+    ### 依報酬走勢將基金分群，用來找出同一標的的不同級別或連結基金。以 get_statistics 的漲跌矩陣標準化後計算相關係數距離（1 - 相關係數）。
+
+    ### 方法：
+    - standardize: 將每檔基金的漲跌標準化成單位向量，內積即為相關係數。
+    - hierarchical: 相關係數距離的階層式分群（single 以分塊計算；average / complete 需要 scipy）。
+    - kmeans: mini-batch k-means 分群。
+    - representatives: 每群選出與群中心最相關的基金作為代表。
+
+    ### 例子：
+    result_df = FundDownloader().run_range("20230520", "20240520")
+    fund_cluster = FundCluster()
+    cluster_df = fund_cluster.hierarchical(result_df, threshold=0.02)
+    cluster_df = fund_cluster.kmeans(result_df, k=200)
+    '''
+
+    def __init__(self, block_size=1024, min_periods=20, seed=0):
+        '''
+        - block_size: int, 分塊計算相關係數時每塊的基金數
+        - min_periods: int, 有效漲跌天數少於此值的基金不分群（群組為 -1）
+        - seed: int, k-means 的隨機種子
+        '''
+        self.block_size = block_size
+        self.min_periods = min_periods
+        self.rng = np.random.default_rng(seed)
+
+
+    def standardize(self, result_df):
+        '''
+        ### 回傳 (基金統編, 標準化矩陣, 是否有效)；缺值以平均數補（標準化後為 0）
+        '''
+        returns = FundDownloader.return_matrix(result_df)
+        values = returns.to_numpy(dtype=float)
+        valid = np.count_nonzero(~np.isnan(values), axis=1) >= self.min_periods
+
+        # 全部缺值的基金會產生警告，之後會標為無效
+        with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            z = (values - np.nanmean(values, axis=1, keepdims=True)) / np.nanstd(values, axis=1, keepdims=True)
+        z = np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0)
+        norms = np.linalg.norm(z, axis=1)
+        valid &= norms > 0
+        z[valid] /= norms[valid, None]
+        z[~valid] = 0.0
+        return returns.index.to_numpy(), z, valid
+
+
+    def hierarchical(self, result_df, threshold=0.05, method='single'):
+        '''
+        ### 相關係數距離的階層式分群，在距離 threshold 處切群
+        - threshold: float, 距離門檻（0.05 代表相關係數 ≥ 0.95 視為同群）
+        - method: str, single / average / complete
+        '''
+        codes, z, valid = self.standardize(result_df)
+        index = np.flatnonzero(valid)
+
+        # 沒有基金達到 min_periods 時全部為 -1；只有一檔時自成一群（linkage 至少需要兩檔）
+        if len(index) < 2:
+            labels = np.arange(len(index))
+        elif method == 'single':
+            labels = self._single_linkage(z[index], threshold)
+        else:
+            try:
+                from scipy.cluster.hierarchy import linkage, fcluster
+            except ImportError:
+                raise ImportError(f'method="{method}" 需要安裝 scipy，或改用 method="single"')
+            distance = 1 - z[index] @ z[index].T
+            condensed = distance[np.triu_indices(len(index), k=1)].clip(min=0)
+            labels = fcluster(linkage(condensed, method=method), t=threshold, criterion='distance') - 1
+
+        return self._result(result_df, codes, z, valid, index, labels)
+
+
+    def kmeans(self, result_df, k=100, batch_size=1024, iterations=100):
+        '''
+        ### mini-batch k-means：每批更新群中心，學習率為 1 / 該群累積筆數
+        - k: int, 群數
+        - batch_size: int, 每批基金數
+        - iterations: int, 批次數
+        '''
+        codes, z, valid = self.standardize(result_df)
+        index = np.flatnonzero(valid)
+        x = z[index]
+        k = min(k, len(x))
+        # 沒有基金達到 min_periods 時全部為 -1
+        if k == 0:
+            return self._result(result_df, codes, z, valid, index, np.array([], dtype=int))
+
+        centers = x[self.rng.choice(len(x), k, replace=False)].copy()
+        counts = np.zeros(k)
+        for _ in range(iterations):
+            batch = x[self.rng.choice(len(x), min(batch_size, len(x)), replace=False)]
+            nearest = self._nearest(batch, centers)
+            batch_counts = np.bincount(nearest, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, nearest, batch)
+            updated = batch_counts > 0
+            counts[updated] += batch_counts[updated]
+            # 等同逐筆以 1 / count 為學習率更新，合併成一次計算
+            rate = batch_counts[updated] / counts[updated]
+            centers[updated] += rate[:, None] * (sums[updated] / batch_counts[updated, None] - centers[updated])
+
+        labels = np.concatenate([self._nearest(x[start:start + self.block_size], centers)
+                                 for start in range(0, len(x), self.block_size)])
+        # 重新編號為連續的群組
+        labels = np.unique(labels, return_inverse=True)[1]
+        return self._result(result_df, codes, z, valid, index, labels)
+
+
+    def representatives(self, z, labels):
+        '''
+        ### 每群選出與群中心內積最大的成員，回傳每個成員所屬群的代表位置
+        '''
+        if len(labels) == 0:
+            return np.array([], dtype=int)
+        groups = labels.max() + 1
+        centroids = np.zeros((groups, z.shape[1]))
+        np.add.at(centroids, labels, z)
+        scores = np.einsum('ij,ij->i', z, centroids[labels])
+        # 依 (群組, -分數) 排序，每群第一筆即為代表
+        order = np.lexsort((-scores, labels))
+        first = np.r_[True, labels[order][1:] != labels[order][:-1]]
+        representative = np.empty(groups, dtype=int)
+        representative[labels[order][first]] = order[first]
+        return representative[labels]
+
+
+    def _single_linkage(self, x, threshold):
+        # 分塊找出距離 <= threshold 的基金對，再以連通分量合併
+        rows, cols = [], []
+        for start in range(0, len(x), self.block_size):
+            distance = 1 - x[start:start + self.block_size] @ x.T
+            i, j = np.nonzero(distance <= threshold)
+            i += start
+            keep = i < j
+            rows.append(i[keep])
+            cols.append(j[keep])
+        rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+        cols = np.concatenate(cols) if cols else np.array([], dtype=int)
+
+        labels = np.arange(len(x))
+        while True:
+            updated = labels.copy()
+            np.minimum.at(updated, rows, labels[cols])
+            np.minimum.at(updated, cols, labels[rows])
+            updated = updated[updated]  # 指標跳躍，加速收斂
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        return np.unique(labels, return_inverse=True)[1]
+
+
+    @staticmethod
+    def _nearest(x, centers):
+        # 單位向量下，歐氏距離最小等同 |c|² - 2x·c 最小
+        return np.argmin((centers ** 2).sum(axis=1) - 2 * x @ centers.T, axis=1)
+
+
+    def _result(self, result_df, codes, z, valid, index, labels):
+        representative = self.representatives(z[index], labels)
+        sizes = np.bincount(labels)
+
+        cluster = np.full(len(codes), -1)
+        cluster[index] = labels
+        rep_code = np.full(len(codes), None, dtype=object)
+        rep_code[index] = codes[index][representative]
+        corr = np.full(len(codes), np.nan)
+        corr[index] = np.einsum('ij,ij->i', z[index], z[index][representative])
+        size = np.zeros(len(codes), dtype=int)
+        size[index] = sizes[labels]
+
+        cluster_df = pd.DataFrame({'基金統編': codes, '群組': cluster, '群組大小': size,
+                                   '代表基金': rep_code, '與代表相關係數': corr})
+        if '基金名稱' in result_df.columns:
+            cluster_df.insert(1, '基金名稱', result_df['基金名稱'].to_numpy())
+        return cluster_df
@@ -7,13 +7,27 @@ import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
+from functools import partial
+from contextlib import nullcontext
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from FundMetrics import FundMetrics
+from FundExport import FundExport
+
+
+# 目前的協程是否已持有共用 semaphore 的名額（重試時的握手不再重複取得，避免死結）
+holding_slot = ContextVar('holding_slot', default=False)
+# 解析與合併共用單一執行緒：多個執行緒同時爭用 GIL 時，事件迴圈很難取回 GIL，查詢會卡住
+parse_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
 
 
 class FundDownloader:
 
-    def __init__(self, company=""):
+    def __init__(self, company="", metrics=None):
         warnings.filterwarnings("ignore", message="Unverified HTTPS request")
         self.company = company
+        self.metrics = metrics or FundMetrics('FundDownloader')
+        self.exporter = FundExport()
 
         self.data_url = "https://www.sitca.org.tw/ROC/Industry/IN2106.aspx?pid=IN2213_02"
         self.basic_url = "https://www.sitca.org.tw/ROC/Industry/IN2105.aspx?pid=IN2212_02"
@@ -91,28 +105,41 @@ class FundDownloader:
             'B': {'範圍': '', '配置': '基金', '標的': ''}
         }
         self.cache = {}  # 異步緩存
+        self.session = None  # 服務模式共用的常駐連線池（FundService）
+        self.semaphore = None  # 排程器共用的同時請求上限（FundJobs / FundService）
+        self.post_dict = None
 
 
     async def fetch_data(self, session, date_str):
         self.post_dict['ctl00$ContentPlaceHolder1$txtQ_Date'] = date_str
+        self.metrics.count('requests')
 
         try:
-            async with session.post(self.data_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
-                response_text = await response.text(encoding='ISO-8859-1')
-                print(f'{date_str}下載完畢')
-                return response_text
+            with self.metrics.stage('fetch', date=date_str):
+                async with session.post(self.data_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
+                    body = await response.read()
+                    response_text = await response.text(encoding='ISO-8859-1')
+            self.metrics.count('bytes', len(body))
+            print(f'{date_str}下載完畢')
+            return response_text
             
         except Exception as e:
+            self.metrics.count('retries')
             self.post_dict = await self.get_post(self.data_url)
             if not self.post_dict:
+                self.metrics.count('failures')
                 return None
             self.post_dict['ctl00$ContentPlaceHolder1$txtQ_Date'] = date_str
             try:
-                async with session.post(self.data_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
-                    response_text = await response.text(encoding='ISO-8859-1')
-                    print(f'{date_str}再次嘗試下載')
-                    return response_text
+                with self.metrics.stage('fetch', date=date_str, retry=True):
+                    async with session.post(self.data_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
+                        body = await response.read()
+                        response_text = await response.text(encoding='ISO-8859-1')
+                self.metrics.count('bytes', len(body))
+                print(f'{date_str}再次嘗試下載')
+                return response_text
             except Exception as e:
+                self.metrics.count('failures')
                 print(f"無法取得 {date_str} 的資料：{str(e)}")
                 return None
 
@@ -121,13 +148,19 @@ class FundDownloader:
         date_str = date.strftime('%Y%m%d')
         response_text = await self.fetch_data(session, date_str)
         if response_text:
-            soup = BeautifulSoup(response_text, "html.parser")
-            return await self.parse_data(soup)  # 直接返回異步處理對象
+            # 解析在執行緒中進行，常駐服務（FundService）下載期間事件迴圈仍能回應查詢
+            return await self.run_parser(self.parse_page, response_text, date_str)
         else:
             return pd.DataFrame()
 
 
-    async def parse_data(self, soup):
+    def parse_page(self, response_text, date_str):
+        with self.metrics.stage('parse', date=date_str):
+            soup = BeautifulSoup(response_text, "html.parser")
+            return self.parse_data(soup)
+
+
+    def parse_data(self, soup):
         fund_dict = {'基金統編': [], '漲跌': []}
         table = soup.find('table')
         if table:
@@ -158,8 +191,9 @@ class FundDownloader:
             result_df["範圍"] = result_df["範圍"].fillna("全球")
                 
         if not result.empty:
-            result_df = result_df.merge(result[['基金統編', '漲跌']], how='left', on='基金統編')
-            result_df.rename(columns={'漲跌': date_time}, inplace=True)
+            with self.metrics.stage('merge', date=date_time):
+                result_df = await self.run_parser(result_df.merge, result[['基金統編', '漲跌']], how='left', on='基金統編')
+                result_df.rename(columns={'漲跌': date_time}, inplace=True)
             
         return result_df
 
@@ -168,12 +202,26 @@ class FundDownloader:
         basic_post = {'ctl00$ContentPlaceHolder1$txtQ_Date': 202403,
                       "ctl00$ContentPlaceHolder1$ddlQ_Column": 1,
                       }
+        # 基本資料一天內不會變動，同一個實例只下載一次
+        if 'basic' in self.cache:
+            return self.cache['basic'].copy()
         basic_post = await self.get_post(self.basic_url)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.basic_url, headers=self.headers, data=basic_post,
-                                    verify_ssl=False) as response:
-                response_text = await response.text()
+        with self.metrics.stage('basic'):
+            async with self.client_session() as session, self.request_slot():
+                async with session.post(self.basic_url, headers=self.headers, data=basic_post,
+                                        verify_ssl=False) as response:
+                    body = await response.read()
+                    response_text = await response.text()
+        self.metrics.count('bytes', len(body))
+        basic_df = await self.run_parser(self.parse_basic, response_text)
+        self.cache['basic'] = basic_df.copy()
+        print(f'基本資料下載完畢')
+
+        return basic_df
+
+
+    def parse_basic(self, response_text):
         soup = BeautifulSoup(response_text, "html.parser")
 
         df_list = []
@@ -196,17 +244,33 @@ class FundDownloader:
                                     "風險等級": risk_level, "計價幣別": pricing_currency
                                     })
 
-        basic_df = pd.DataFrame(df_list)
-        print(f'基本資料下載完畢')
+        return pd.DataFrame(df_list)
 
-        return basic_df
+
+    async def run_parser(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(parse_executor, partial(func, *args, **kwargs))
+
+
+    def client_session(self, headers=None):
+        # 有常駐的連線池時直接共用，否則每次建立新的 session
+        if self.session is not None and not self.session.closed:
+            return nullcontext(self.session)
+        return aiohttp.ClientSession(headers=headers)
+
+
+    def request_slot(self):
+        # 握手與基本資料的請求也計入共用的同時請求數
+        if self.semaphore is None or holding_slot.get():
+            return nullcontext()
+        return self.semaphore
 
 
     async def get_post(self, url, post_dict=None):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=self.headers, data=post_dict, verify_ssl=False) as response:
-                    html = await response.text()
+            async with self.client_session() as session, self.request_slot():
+                with self.metrics.stage('token'):
+                    async with session.post(url, headers=self.headers, data=post_dict, verify_ssl=False) as response:
+                        html = await response.text()
 
                 soup = BeautifulSoup(html, 'html.parser')
 
@@ -225,10 +289,13 @@ class FundDownloader:
             return None
 
 
-    async def range_main(self, date_df, headers):
-        self.post_dict = await self.get_post(self.data_url)
-        async with aiohttp.ClientSession(headers=headers) as session:
-            semaphore = asyncio.Semaphore(len(date_df))  
+    async def range_main(self, date_df, headers, semaphore=None):
+        # 未指定時不限制並發；由排程器共用同一個 semaphore 控制總請求量（含握手）
+        self.semaphore = semaphore = semaphore or asyncio.Semaphore(max(len(date_df), 1))
+        # 常駐連線池沿用上次的請求碼，失效時由 fetch_data 重新取得
+        if self.session is None or not self.post_dict:
+            self.post_dict = await self.get_post(self.data_url)
+        async with self.client_session(headers) as session:
             tasks = [self.download_data_with_semaphore(session, date, semaphore) for date in date_df]
             results = await asyncio.gather(*tasks)
             result_df = pd.DataFrame()
@@ -239,10 +306,19 @@ class FundDownloader:
 
     async def download_data_with_semaphore(self, session, date, semaphore):
         async with semaphore:
-            return await self.download_data(session, date)
+            token = holding_slot.set(True)
+            try:
+                return await self.download_data(session, date)
+            finally:
+                holding_slot.reset(token)
 
 
     def get_statistics(self, result_df):
+        with self.metrics.stage('statistics', rows=len(result_df)):
+            return self._get_statistics(result_df)
+
+
+    def _get_statistics(self, result_df):
         # 複製日期字串的列
         date_columns = result_df.columns[7:]
         result_df[date_columns] = result_df[date_columns].apply(pd.to_numeric, errors='coerce')
@@ -268,22 +344,48 @@ class FundDownloader:
         return result_df
 
 
-    def run_range(self, start_date, end_date, to_excel=False):
-        
-        date_df = pd.date_range(start_date, end_date, freq='B')
-        print(f'總請求筆數: {len(date_df)}筆')
-        
-        result_df = asyncio.run(self.range_main(date_df, self.headers))
-        result_df = self.get_statistics(result_df)
+    @staticmethod
+    def return_matrix(result_df):
+        '''
+        ### 取出 (基金 × 日期) 的漲跌矩陣，索引為基金統編、欄位為日期
+        '''
+        date_columns = [col for col in result_df.columns if re.match(r'^\d{4}-\d{2}-\d{2}$', str(col))]
+        returns = result_df[date_columns].apply(pd.to_numeric, errors='coerce')
+        returns.index = result_df['基金統編'].astype(str)
+        returns.columns = pd.to_datetime(date_columns, format='%Y-%m-%d')
+        return returns.sort_index(axis=1)
+
+
+    def run_range(self, start_date, end_date, to_excel=False, file_type='xlsx', split_sheets=False):
+        '''
+        ### 下載區間內每個營業日的漲跌
+        - to_excel: bool, 是否寫出報表
+        - file_type: str, 報表格式（xlsx / csv / parquet）
+        - split_sheets: bool, 是否拆成 基本資料 / 漲跌 / 統計 三個工作表
+        '''
+        result_df = asyncio.run(self.run_range_async(start_date, end_date))
         
         if to_excel:
-            result_df.to_excel(f'{start_date}-{end_date}基金資料.xlsx', index=False)
+            sheets = self.exporter.split_sheets(result_df) if split_sheets else result_df
+            with self.metrics.stage('write', rows=len(result_df)):
+                self.exporter.write(sheets, f'{start_date}-{end_date}基金資料.{file_type}')
         return result_df
 
 
+    async def run_range_async(self, start_date, end_date, semaphore=None):
+        date_df = pd.date_range(start_date, end_date, freq='B')
+        print(f'總請求筆數: {len(date_df)}筆')
+
+        result_df = await self.range_main(date_df, self.headers, semaphore)
+        return self.get_statistics(result_df)
+
+
     def merge_df(self, result_df, new_data):
         merge_columns = ['基金統編', '基金名稱', '風險等級', '計價幣別', '範圍', '配置', '標的']
-        result_df = pd.merge(result_df, new_data, on=merge_columns, how="outer")
+        # 只以基金統編合併，名稱、風險等級等異動時不會拆成兩列；基本資料以新資料為準，新資料沒有的基金保留原本的
+        result_df = pd.merge(result_df, new_data, on='基金統編', how="outer")
+        for col in merge_columns[1:]:
+            result_df[col] = result_df[f'{col}_y'].combine_first(result_df[f'{col}_x'])
         # 找到包含 "_x" 或 "_y" 的列标题
         columns_to_drop = [col for col in result_df.columns if '_x' in col or '_y' in col]
         # 删除这些列
@@ -300,7 +402,8 @@ class FundDownloader:
     def missing_list(self, result_df, start_date, end_date):
         # 生成日期範圍
         date_list = pd.Series(pd.date_range(start_date, end_date, freq='B'))
-        data_index = pd.Series(result_df.iloc[:, 9:].columns)
+        # 已移除平均值與標準差，日期欄從第 8 欄開始
+        data_index = pd.Series(result_df.iloc[:, 7:].columns)
         data_index = pd.to_datetime(data_index, format="%Y-%m-%d")
         print(f'data_index:\n{data_index}')
 
@@ -316,7 +419,8 @@ class FundDownloader:
         start_time = time.time()
         # 讀取 Excel 文件
         try:
-            result_df = pd.read_excel(f'{file_name}.xlsx')
+            with self.metrics.stage('read'):
+                result_df = pd.read_excel(f'{file_name}.xlsx')
             result_df = result_df.drop(columns=["平均值","標準差"])
         except FileNotFoundError:
             print(f'找不到{file_name}.xlsx')
@@ -330,14 +434,16 @@ class FundDownloader:
 
         new_data = asyncio.run(self.range_main(missing_dates, self.headers))
         
-        result_df = self.merge_df(result_df, new_data)
+        with self.metrics.stage('merge', rows=len(result_df)):
+            result_df = self.merge_df(result_df, new_data)
         result_df = self.get_statistics(result_df)
 
         end_time = time.time()
         print(f'下載{start_date}-{end_date}基金耗時:{round(end_time - start_time, 4)}秒')
 
         # 保存到 Excel 文件
-        result_df.to_excel(f'{start_date}-{end_date}基金資料.xlsx', index=False)
+        with self.metrics.stage('write', rows=len(result_df)):
+            self.exporter.write(result_df, f'{start_date}-{end_date}基金資料.xlsx')
         print(f"數據已保存到 {file_name}.xlsx")
 
         return result_df
@@ -362,6 +468,7 @@ if __name__ == "__main__":
     file_name = f"{start_date}-{end_date}基金資料"
     result_df = fond_downloader.missing_data(file_name, start_date, end_date)
     print(result_df.info())
+    fond_downloader.metrics.report()
 
 
 
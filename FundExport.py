@@ -0,0 +1,142 @@
+import os
+import csv
+import math
+import numbers
+import datetime
+import pandas as pd
+
+
+class FundExport:
+    '''
+    ## FundExport
+    ### 以串流方式寫出報表：逐列寫入，不在記憶體中建立整本活頁簿，支援 xlsx、csv 與 parquet。
+
+    ### 方法：
+    - write: 依副檔名選擇格式寫出一個或多個工作表。
+    - write_xlsx: 使用 xlsxwriter 的 constant_memory 模式逐列寫出。
+    - write_csv: 逐列寫出 csv，多個工作表時每個工作表一個檔案。
+    - write_parquet: 以固定列數分批寫成 parquet 的 row group。
+    - split_sheets: 將基金資料拆成 基本資料 / 漲跌 / 統計 三個工作表。
+
+    ### 例子：
+    exporter = FundExport()
+    exporter.write(result_df, '20240101-20240131基金資料.xlsx')
+    exporter.write(exporter.split_sheets(result_df), '20240101-20240131基金資料.xlsx')
+    exporter.write(result_df, '20240101-20240131基金資料.parquet')
+    '''
+
+    meta_columns = ['基金統編', '基金名稱', '風險等級', '計價幣別', '範圍', '配置', '標的']
+    stat_columns = ['平均值', '標準差']
+
+
+    def __init__(self, chunk_size=5000):
+        '''
+        - chunk_size: int, parquet 每個 row group 的列數
+        '''
+        self.chunk_size = chunk_size
+
+
+    def write(self, sheets, path):
+        '''
+        ### 依副檔名寫出報表
+        - sheets: DataFrame 或 dict[str, DataFrame]（工作表名稱 -> 資料）
+        - path: str, 輸出路徑（.xlsx / .csv / .parquet）
+        '''
+        if isinstance(sheets, pd.DataFrame):
+            sheets = {'Sheet1': sheets}
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.xlsx':
+            self.write_xlsx(sheets, path)
+        elif ext == '.csv':
+            self.write_csv(sheets, path)
+        elif ext == '.parquet':
+            self.write_parquet(sheets, path)
+        else:
+            raise ValueError(f'不支援的檔案格式: {ext}')
+        return path
+
+
+    def write_xlsx(self, sheets, path):
+        try:
+            import xlsxwriter
+        except ImportError:
+            print('未安裝 xlsxwriter，改用 DataFrame.to_excel 寫出')
+            with pd.ExcelWriter(path) as writer:
+                for name, df in sheets.items():
+                    df.to_excel(writer, sheet_name=name, index=False)
+            return
+
+        # constant_memory 模式下每寫完一列就會刷新到暫存檔，必須依列順序寫入；±inf 寫成 Excel 的錯誤值（與 to_excel 一樣不中斷）
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True, 'remove_timezone': True})
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        try:
+            for name, df in sheets.items():
+                worksheet = workbook.add_worksheet(name)
+                worksheet.write_row(0, 0, [str(col) for col in df.columns])
+                for row_num, row in enumerate(df.itertuples(index=False, name=None), start=1):
+                    for col_num, value in enumerate(row):
+                        if self._is_blank(value):
+                            continue
+                        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+                            worksheet.write_number(row_num, col_num, value)
+                        elif isinstance(value, datetime.datetime):
+                            midnight = value.time() == datetime.time()
+                            worksheet.write_datetime(row_num, col_num, value, date_format if midnight else datetime_format)
+                        elif isinstance(value, datetime.date):
+                            worksheet.write_datetime(row_num, col_num, value, date_format)
+                        else:
+                            worksheet.write_string(row_num, col_num, str(value))
+        finally:
+            workbook.close()
+
+
+    def write_csv(self, sheets, path):
+        for name, df in sheets.items():
+            sheet_path = path if len(sheets) == 1 else self._sheet_path(path, name)
+            # utf-8-sig 讓 Excel 能正確顯示中文
+            with open(sheet_path, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(df.columns)
+                for row in df.itertuples(index=False, name=None):
+                    writer.writerow(['' if self._is_blank(value) else value for value in row])
+
+
+    def write_parquet(self, sheets, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for name, df in sheets.items():
+            sheet_path = path if len(sheets) == 1 else self._sheet_path(path, name)
+            df = df.rename(columns=str)
+            # 以第一批資料推斷 schema，之後每批都轉成同一個 schema
+            schema = pa.Schema.from_pandas(df.head(self.chunk_size), preserve_index=False)
+            with pq.ParquetWriter(sheet_path, schema) as writer:
+                for start in range(0, max(len(df), 1), self.chunk_size):
+                    chunk = df.iloc[start:start + self.chunk_size]
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+    def split_sheets(self, result_df):
+        '''
+        ### 將 get_statistics 的結果拆成 基本資料 / 漲跌 / 統計 三個工作表
+        '''
+        meta_columns = [col for col in self.meta_columns if col in result_df.columns]
+        stat_columns = [col for col in self.stat_columns if col in result_df.columns]
+        date_columns = [col for col in result_df.columns if col not in meta_columns + stat_columns]
+        return {
+            '基本資料': result_df[meta_columns],
+            '漲跌': result_df[['基金統編'] + date_columns],
+            '統計': result_df[['基金統編', '基金名稱'] + stat_columns],
+        }
+
+
+    def _sheet_path(self, path, name):
+        root, ext = os.path.splitext(path)
+        return f'{root}_{name}{ext}'
+
+
+    @staticmethod
+    def _is_blank(value):
+        return value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NA or value is pd.NaT
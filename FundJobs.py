@@ -0,0 +1,157 @@
+import sys
+import time
+import asyncio
+import inspect
+from FundRate import FundRate
+from FundExport import FundExport
+from FundDownloader import FundDownloader
+
+
+class FundJobs:
+    '''
+    ## FundJobs
+    ### 在同一個事件迴圈中並行執行基金、配息與 ETF 工作，依照相依關係排程，並共用並發上限。
+
+    ### 方法：
+    - add: 加入一個工作（協程函式、一般函式或外部腳本）及其相依工作。
+    - script: 建立以子行程執行外部腳本的工作。
+    - run: 執行所有工作並回傳各工作的結果。
+    - report: 印出各工作的等待時間、耗時與關鍵路徑。
+    - critical_path: 取得決定總耗時的工作鏈。
+
+    ### 例子：
+    jobs = FundJobs(network=16, workers=2)
+    jobs.add('fund', lambda sem: FundDownloader().run_range_async("20240101", "20240131", sem))
+    jobs.add('rate', lambda sem: FundRate().run_async("20240101", "20240131", sem))
+    jobs.add('etf', jobs.script('ETFDownloader copy.py'))
+    jobs.add('export', lambda: FundExport().write(jobs.results['fund'], '基金資料.xlsx'), deps=['fund', 'rate'])
+    results = jobs.run()
+    jobs.report()
+    '''
+
+    def __init__(self, network=16, workers=2):
+        '''
+        - network: int, 所有工作共用的同時 HTTP 請求上限
+        - workers: int, 同時在執行緒或子行程中執行的阻塞工作上限
+        '''
+        self.network = network
+        self.workers = workers
+        self.jobs = {}      # name -> {'func', 'deps'}
+        self.results = {}   # name -> 結果
+        self.timings = {}   # name -> {'ready', 'start', 'end'}
+
+
+    def add(self, name, func, deps=None):
+        '''
+        ### 加入工作
+        - name: str, 工作名稱
+        - func: 協程函式 func(semaphore)，或一般函式 func()（在執行緒中執行）
+        - deps: list[str], 需要先完成的工作
+        '''
+        deps = list(deps or [])
+        for dep in deps:
+            if dep not in self.jobs:
+                raise ValueError(f'{name} 的相依工作 {dep} 尚未加入')
+        self.jobs[name] = {'func': func, 'deps': deps}
+        return self
+
+
+    def script(self, path, *args):
+        '''
+        ### 以子行程執行外部腳本（例如 ETF 下載腳本），回傳其標準輸出
+        '''
+        async def run_script(semaphore):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, path, *args,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f'{path} 執行失敗:\n{stderr.decode(errors="ignore")}')
+            return stdout.decode(errors='ignore')
+        run_script.blocking = True
+        return run_script
+
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+
+    async def run_async(self):
+        network = asyncio.Semaphore(self.network)
+        workers = asyncio.Semaphore(self.workers)
+        self.origin = time.perf_counter()
+        tasks = {}
+
+        async def run_job(name):
+            job = self.jobs[name]
+            if job['deps']:
+                await asyncio.gather(*(tasks[dep] for dep in job['deps']))
+            ready = time.perf_counter()
+            func = job['func']
+
+            # 不帶參數的函式視為阻塞工作，放到執行緒中執行
+            if not inspect.signature(func).parameters:
+                async with workers:
+                    start = time.perf_counter()
+                    result = await asyncio.to_thread(func)
+            elif getattr(func, 'blocking', False):
+                async with workers:
+                    start = time.perf_counter()
+                    result = await func(network)
+            else:
+                start = time.perf_counter()
+                result = await func(network)
+
+            end = time.perf_counter()
+            self.results[name] = result
+            self.timings[name] = {'ready': ready - self.origin, 'start': start - self.origin, 'end': end - self.origin}
+            print(f'{name} 完成，耗時:{round(end - start, 4)}秒')
+            return result
+
+        # 工作依加入順序建立，相依工作必定先建立
+        for name in self.jobs:
+            tasks[name] = asyncio.ensure_future(run_job(name))
+        await asyncio.gather(*tasks.values())
+        return self.results
+
+
+    def critical_path(self):
+        '''
+        ### 由最後完成的工作往回追溯最晚完成的相依工作
+        '''
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda job: self.timings[job]['end'])
+        path = [name]
+        while self.jobs[name]['deps']:
+            name = max(self.jobs[name]['deps'], key=lambda job: self.timings[job]['end'])
+            path.append(name)
+        return path[::-1]
+
+
+    def report(self):
+        print('工作耗時:')
+        for name, timing in self.timings.items():
+            print(f" {name:<10} 等待:{timing['start'] - timing['ready']:>8.4f}秒  "
+                  f"開始:{timing['start']:>8.4f}秒  耗時:{timing['end'] - timing['start']:>8.4f}秒")
+        path = self.critical_path()
+        total = max(timing['end'] for timing in self.timings.values()) if self.timings else 0
+        print(f"關鍵路徑: {' -> '.join(path)}  總耗時:{round(total, 4)}秒")
+
+
+
+
+
+if __name__ == "__main__":
+
+    start_date = "20240401"
+    end_date = "20240430"
+
+    jobs = FundJobs(network=16, workers=2)
+    jobs.add('fund', lambda sem: FundDownloader().run_range_async(start_date, end_date, sem))
+    jobs.add('rate', lambda sem: FundRate().run_async(start_date, end_date, sem))
+    jobs.add('etf', jobs.script('ETFDownloader copy.py'))
+    jobs.add('export', lambda: FundExport().write(jobs.results['fund'], f'{start_date}-{end_date}基金資料.xlsx'),
+             deps=['fund', 'rate'])
+    jobs.run()
+    jobs.report()
@@ -0,0 +1,237 @@
+import io
+import os
+import json
+import math
+import time
+import bisect
+import pstats
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+class FundMetrics:
+    '''
+    ## FundMetrics
+    ### 下載流程的分段量測：記錄每個階段（下載、請求碼、解析、合併、統計、寫檔）的耗時分佈、位元組與重試次數。
+
+    ### 方法：
+    - stage: 以 with 區塊量測一個階段的耗時（可選擇啟用 cProfile）。
+    - observe: 直接記錄一筆階段耗時。
+    - count: 累加計數器（請求數、位元組、重試、失敗）。
+    - snapshot: 取得目前所有指標的 dict。
+    - to_json / to_prometheus: 輸出 JSON 或 Prometheus 文字格式。
+    - save: 依副檔名（.json / .prom）寫出快照。
+    - report: 印出各階段摘要。
+    - dump_profiles: 將各階段 cProfile 結果寫成 .prof 檔。
+
+    ### 例子：
+    metrics = FundMetrics('FundDownloader', log_file='metrics.log', profile_stages={'parse'})
+    fund_downloader = FundDownloader(metrics=metrics)
+    fund_downloader.run_range("20240101", "20240131")
+    metrics.report()
+    metrics.save('metrics.prom')
+    '''
+
+    # 耗時分佈的桶上限（秒）
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # 區塊內有 await 的階段：cProfile 會把同一事件迴圈上其他協程的工作也算進去
+    async_stages = {'fetch', 'token', 'basic'}
+
+
+    def __init__(self, job="fund", log_file=None, profile_stages=None, profiler=None, keep_samples=False):
+        '''
+        - job: str, 指標標籤中的工作名稱
+        - log_file: str, 結構化日誌（JSON lines）輸出路徑，None 則只送到 logging
+        - profile_stages: set[str], 需要 profile 的階段名稱；使用 cProfile 時只允許同步階段（parse、merge、statistics、read、write）
+        - profiler: callable(stage) -> context manager, 自訂的取樣 profiler（預設使用 cProfile）
+        - keep_samples: bool, 保留每筆耗時以計算精確分位數（基準測試用）
+        '''
+        self.job = job
+        self.profile_stages = set(profile_stages or [])
+        if profiler is None and self.profile_stages & self.async_stages:
+            raise ValueError(f'cProfile 無法分開其他協程的耗時，不能用於 {self.profile_stages & self.async_stages}，請改用自訂 profiler')
+        self.profiler = profiler
+        self.keep_samples = keep_samples
+
+        self.histograms = {}  # stage -> {'count', 'sum', 'max', 'buckets'}
+        self.counters = {}    # name -> value
+        self.profiles = {}    # stage -> pstats.Stats
+        self.samples = {}     # stage -> list[float]，keep_samples 時才記錄
+        self._profiling = False
+        self._lock = threading.Lock()  # 解析與合併在執行緒中進行時也會記錄指標
+
+        self.logger = logging.getLogger(f"FundMetrics.{job}")
+        # 同名 job 共用 logger，同一個檔案只加一次 handler，避免重複寫入
+        if log_file and not any(isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file)
+                                for handler in self.logger.handlers):
+            handler = logging.FileHandler(log_file, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+        if log_file:
+            self.logger.setLevel(logging.INFO)
+
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        '''
+        ### 量測一個階段的耗時；區塊拋出例外時記錄到 {stage}_error，失敗與逾時的嘗試不混入成功的耗時分佈
+        - stage: str, 階段名稱
+        - fields: 額外寫入結構化日誌的欄位（例如 date、rows）
+        '''
+        start = time.perf_counter()
+        with self._profile(stage):
+            try:
+                yield fields
+            except BaseException:
+                self.observe(f'{stage}_error', time.perf_counter() - start, **fields)
+                raise
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+
+    def _profile(self, stage):
+        # 同一時間只允許一個 profiler 啟用，避免並發的協程與執行緒互相干擾
+        if stage not in self.profile_stages or self._profiling:
+            return nullcontext()
+        if self.profiler is not None:
+            return self.profiler(stage)
+        with self._lock:
+            if self._profiling:
+                return nullcontext()
+            self._profiling = True
+        return self._cprofile(stage)
+
+
+    @contextmanager
+    def _cprofile(self, stage):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiling = False
+                if stage in self.profiles:
+                    self.profiles[stage].add(profile)
+                else:
+                    self.profiles[stage] = pstats.Stats(profile, stream=io.StringIO())
+
+
+    def observe(self, stage, seconds, **fields):
+        '''
+        ### 記錄一筆階段耗時
+        - stage: str, 階段名稱
+        - seconds: float, 耗時（秒）
+        '''
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(self.buckets) + 1)}
+                self.histograms[stage] = hist
+            hist['count'] += 1
+            hist['sum'] += seconds
+            hist['max'] = max(hist['max'], seconds)
+            hist['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            if self.keep_samples:
+                self.samples.setdefault(stage, []).append(seconds)
+        self.log(stage, seconds=round(seconds, 6), **fields)
+
+
+    def count(self, name, value=1):
+        '''
+        ### 累加計數器
+        - name: str, 計數器名稱（例如 requests、bytes、retries、failures）
+        - value: int, 增加量
+        '''
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def log(self, event, **fields):
+        # 未啟用日誌時不序列化，避免高頻階段的額外成本
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        record = {'ts': round(time.time(), 6), 'job': self.job, 'event': event}
+        record.update(fields)
+        self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+    def quantile(self, stage, q):
+        '''
+        ### 由分佈桶估計分位數（取所在桶的上限）；有保留樣本時回傳精確值
+        '''
+        hist = self.histograms.get(stage)
+        if not hist or hist['count'] == 0:
+            return None
+        if stage in self.samples:
+            samples = sorted(self.samples[stage])
+            return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+        target = q * hist['count']
+        seen = 0
+        for upper, n in zip(self.buckets + (hist['max'],), hist['buckets']):
+            seen += n
+            if seen >= target:
+                return min(upper, hist['max'])
+        return hist['max']
+
+
+    def snapshot(self):
+        stages = {}
+        for stage, hist in self.histograms.items():
+            stages[stage] = {
+                'count': hist['count'],
+                'sum': round(hist['sum'], 6),
+                'mean': round(hist['sum'] / hist['count'], 6),
+                'max': round(hist['max'], 6),
+                'p50': self.quantile(stage, 0.5),
+                'p99': self.quantile(stage, 0.99),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], hist['buckets'])),
+            }
+        return {'job': self.job, 'stages': stages, 'counters': dict(self.counters)}
+
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=indent)
+
+
+    def to_prometheus(self):
+        lines = ['# TYPE fund_stage_seconds histogram']
+        for stage, hist in self.histograms.items():
+            labels = f'job="{self.job}",stage="{stage}"'
+            cumulative = 0
+            for upper, n in zip(self.buckets, hist['buckets']):
+                cumulative += n
+                lines.append(f'fund_stage_seconds_bucket{{{labels},le="{upper}"}} {cumulative}')
+            lines.append(f'fund_stage_seconds_bucket{{{labels},le="+Inf"}} {hist["count"]}')
+            lines.append(f'fund_stage_seconds_sum{{{labels}}} {hist["sum"]:.6f}')
+            lines.append(f'fund_stage_seconds_count{{{labels}}} {hist["count"]}')
+        lines.append('# TYPE fund_events_total counter')
+        for name, value in self.counters.items():
+            lines.append(f'fund_events_total{{job="{self.job}",name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def save(self, path):
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f'指標已保存到 {path}')
+
+
+    def dump_profiles(self, prefix=None):
+        prefix = prefix or self.job
+        for stage, stats in self.profiles.items():
+            stats.dump_stats(f'{prefix}_{stage}.prof')
+            print(f'{stage} 階段 profile 已保存到 {prefix}_{stage}.prof')
+
+
+    def report(self):
+        print(f'[{self.job}] 階段耗時:')
+        for stage, info in self.snapshot()['stages'].items():
+            print(f" {stage:<12} 次數:{info['count']:>6}  總計:{info['sum']:>10.4f}秒  "
+                  f"平均:{info['mean']:.4f}  p50:{info['p50']:.4f}  p99:{info['p99']:.4f}  最大:{info['max']:.4f}")
+        if self.counters:
+            print(f' 計數: {self.counters}')
@@ -0,0 +1,404 @@
+import warnings
+import numpy as np
+import pandas as pd
+from FundDownloader import FundDownloader
+
+
+class FundOptimizer:
+    '''
+    ## FundOptimizer
+    ### 以 get_statistics 的結果做平均數－變異數最適化：計算效率前緣與風險預算配置，可依 風險等級、計價幣別、範圍 設定篩選與權重上限。
+
+    ### 方法：
+    - fit: 由漲跌矩陣建立預期報酬與（收縮後的）共變異數。
+    - optimize: 求解單一風險趨避係數下的最適權重（active set 法求 KKT 精確解，加速投影梯度法提供起點）。
+    - frontier: 以 warm start 依序求解整條效率前緣。
+    - risk_budget: 風險預算配置（各基金風險貢獻符合指定比例，牛頓法）。
+
+    ### 限制條件：
+    - allowed: {'風險等級': ['RR1', 'RR2'], '計價幣別': ['TWD']} 只保留符合的基金
+    - caps: {'範圍': {'中國': 0.1}, '風險等級': {'RR5': 0.2}} 各類別權重合計上限
+    - max_weight: 單一基金權重上限
+
+    ### 例子：
+    result_df = FundDownloader().run_range("20230520", "20240520")
+    optimizer = FundOptimizer(max_weight=0.05, caps={'範圍': {'中國': 0.1}})
+    optimizer.fit(result_df)
+    frontier_df, weights_df = optimizer.frontier(points=50)
+    budget = optimizer.risk_budget()
+    '''
+
+    def __init__(self, max_weight=1.0, allowed=None, caps=None, shrinkage=0.1, periods_per_year=252,
+                 tolerance=1e-6, max_iter=1000):
+        '''
+        - max_weight: float, 單一基金權重上限
+        - allowed: dict[str, list], 依欄位篩選可投資的基金
+        - caps: dict[str, dict[str, float]], 依欄位分類的權重合計上限
+        - shrinkage: float, 共變異數向對角線收縮的比例（基金數多於天數時共變異數不可逆）
+        - periods_per_year: int, 年化時每年的交易日數
+        '''
+        self.max_weight = max_weight
+        self.allowed = allowed or {}
+        self.caps = caps or {}
+        self.shrinkage = shrinkage
+        self.periods_per_year = periods_per_year
+        self.tolerance = tolerance
+        self.max_iter = max_iter
+
+
+    def fit(self, result_df):
+        '''
+        ### 建立預期報酬（平均值）與共變異數的因子形式 Σ = (1-s)XᵀX/(T-1) + s·diag
+        '''
+        returns = FundDownloader.return_matrix(result_df)
+        values = returns.to_numpy(dtype=float).T  # (日期 × 基金)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+        usable = ~np.isnan(mean)
+
+        self.codes = returns.index.to_numpy()
+        self.mean = np.nan_to_num(mean)
+        x = np.nan_to_num(values - mean)  # 缺值視為平均數
+        self.x = x / np.sqrt(max(len(x) - 1, 1))
+        self.var = (self.x ** 2).sum(axis=0)
+
+        # 可投資基金與權重上限
+        self.upper = np.where(usable, self.max_weight, 0.0)
+        for column, values_allowed in self.allowed.items():
+            self.upper[~result_df[column].isin(values_allowed).to_numpy()] = 0.0
+        if self.upper.sum() < 1:
+            raise ValueError('可投資基金的權重上限合計小於 1，請放寬篩選條件或 max_weight')
+
+        # 類別上限：每個欄位只保留上限會生效的類別，依類別排序成 (基金位置, 類別代號, 起點, 上限)；
+        # 另外整理成 (基金 × 類別) 的成員矩陣供 active set 法使用
+        self.groups = []
+        membership, cap_limit = [], []
+        for column, column_caps in self.caps.items():
+            codes, names = pd.factorize(result_df[column].fillna(''))
+            limit = np.array([column_caps.get(name, np.inf) for name in names])
+            capacity = np.bincount(codes, weights=self.upper, minlength=len(names))
+            if np.minimum(capacity, limit).sum() < 1:
+                raise ValueError(f'{column} 的類別上限合計小於 1，請放寬 caps')
+            binding = np.flatnonzero(capacity > limit)
+            if not len(binding):
+                continue
+            index = np.flatnonzero(np.isin(codes, binding))
+            index = index[np.argsort(codes[index], kind='stable')]
+            local = np.searchsorted(binding, codes[index])
+            starts = np.searchsorted(local, np.arange(len(binding)))
+            self.groups.append((index, local, starts, limit[binding]))
+            membership += [(codes == group).astype(float) for group in binding]
+            cap_limit += list(limit[binding])
+        self.membership = np.column_stack(membership) if membership else np.zeros((len(self.codes), 0))
+        self.cap_limit = np.array(cap_limit)
+
+        self.lipschitz = self._max_eigenvalue()
+        self._tau = 0.0
+        return self
+
+
+    def covariance_dot(self, w):
+        # Σw，不建立 N × N 矩陣
+        return (1 - self.shrinkage) * (self.x.T @ (self.x @ w)) + self.shrinkage * self.var * w
+
+
+    def optimize(self, risk_aversion=1.0, w0=None):
+        '''
+        ### 求解 max μᵀw - (γ/2)·wᵀΣw，條件為 Σw = 1、0 ≤ w ≤ 上限、類別上限
+        有 warm start 時直接以 active set 法求解；否則（或 active set 未收斂時）先以投影梯度法求近似解再修正
+        - risk_aversion: float, 風險趨避係數 γ（np.inf 為最小變異數）
+        - w0: ndarray, 初始權重（warm start）
+        '''
+        gamma, mean = (1.0, np.zeros_like(self.mean)) if np.isinf(risk_aversion) else (risk_aversion, self.mean)
+        if w0 is not None:
+            w = self._active_set(gamma, mean, w0)
+            if w is not None:
+                return w
+        w = self._fista(gamma, mean, w0)
+        polished = self._active_set(gamma, mean, w)
+        return w if polished is None else polished
+
+
+    def _fista(self, gamma, mean, w0=None):
+        # 加速投影梯度法（FISTA + adaptive restart）
+        gradient = lambda w: gamma * self.covariance_dot(w) - mean
+        step = 1 / (gamma * self.lipschitz)
+
+        w = self.project(self.upper / self.upper.sum() if w0 is None else w0)
+        y, t = w, 1.0
+        for _ in range(self.max_iter):
+            w_next = self.project(y - step * gradient(y))
+            if np.max(np.abs(w_next - w)) < self.tolerance:
+                return w_next
+            # 動量方向與進展方向相反時重新開始（adaptive restart）
+            if np.dot(y - w_next, w_next - w) > 0:
+                t = 1.0
+            t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+            y = w_next + (t - 1) / t_next * (w_next - w)
+            w, t = w_next, t_next
+        return w
+
+
+    def frontier(self, points=50):
+        '''
+        ### 由最小變異數到最高報酬依序求解，每一點以前一點的解為起點
+        回傳 (前緣 DataFrame, 權重 DataFrame)
+        '''
+        w = self.optimize(np.inf)
+        # 最高報酬端：依報酬由高到低填滿權重上限
+        w_max = self._max_return()
+        # 前緣的平均斜率 Δμ/Δσ² 對應 γ/2，以此為中心取對數等距的 γ
+        delta_mean = max((w_max - w) @ self.mean, 1e-12)
+        delta_var = max(w_max @ self.covariance_dot(w_max) - w @ self.covariance_dot(w), 1e-12)
+        gammas = np.geomspace(1e3, 1e-1, points - 1) * 2 * delta_mean / delta_var
+
+        weights = [w]
+        for gamma in gammas:
+            w = self.optimize(gamma, w)
+            weights.append(w)
+
+        weights = np.array(weights)
+        frontier_df = self._describe(weights)
+        frontier_df.insert(0, '風險趨避係數', np.r_[np.inf, gammas])
+        weights_df = pd.DataFrame(weights, columns=self.codes)
+        return frontier_df, weights_df
+
+
+    def risk_budget(self, budget=None, iterations=100):
+        '''
+        ### 風險預算：使各基金風險貢獻 wᵢ(Σw)ᵢ / wᵀΣw 等於 budget（預設為可投資基金均分）
+        求解凸問題 min ½wᵀΣw - Σbᵢ·log wᵢ（w > 0），最適解滿足 wᵢ(Σw)ᵢ = bᵢ，再縮放成權重合計為 1。
+        以牛頓法（Woodbury 解海森矩陣）迭代，負相關的基金也會保留正權重。
+        風險預算的解是唯一的，無法再加上 max_weight 與 caps；解超過上限時拋出 ValueError。
+        '''
+        if budget is None:
+            budget = (self.upper > 0).astype(float)
+        budget = np.asarray(budget, dtype=float) * (self.upper > 0)
+        active = np.flatnonzero(budget > 0)
+        b = budget[active] / budget[active].sum()
+
+        def objective(v):
+            full = np.zeros(len(self.codes))
+            full[active] = v
+            sigma_w = self.covariance_dot(full)[active]
+            return 0.5 * v @ sigma_w - b @ np.log(v), sigma_w
+
+        v = b / np.sqrt(self.var[active] + 1e-12)
+        value, sigma_w = objective(v)
+        for _ in range(iterations):
+            if np.max(np.abs(v * sigma_w / b - 1)) < 1e-10:
+                break
+            gradient = sigma_w - b / v
+            direction = self._solve(active, self.shrinkage * self.var[active] + b / v ** 2, 1 - self.shrinkage, gradient)
+            # 步長不超過使權重變為 0 的距離，再以 Armijo 條件回溯
+            shrink = direction > 0
+            step = min(1.0, 0.99 * np.min(v[shrink] / direction[shrink])) if shrink.any() else 1.0
+            while True:
+                candidate = v - step * direction
+                candidate_value, candidate_sigma_w = objective(candidate)
+                if candidate_value <= value - 1e-4 * step * (gradient @ direction) or step < 1e-12:
+                    break
+                step /= 2
+            v, value, sigma_w = candidate, candidate_value, candidate_sigma_w
+
+        w = np.zeros(len(self.codes))
+        w[active] = v / v.sum()
+        if np.any(w > self.upper + 1e-9) or np.any(self.membership.T @ w > self.cap_limit + 1e-9):
+            raise ValueError('風險預算配置的權重超過 max_weight 或 caps，請放寬上限或調整 budget')
+
+        budget_df = pd.DataFrame({'基金統編': self.codes, '權重': w,
+                                  '風險貢獻': w * self.covariance_dot(w) / (w @ self.covariance_dot(w))})
+        return budget_df[budget_df['權重'] > 0].reset_index(drop=True)
+
+
+    def project(self, v):
+        '''
+        ### 投影到可行集合；只有一個欄位設定類別上限時為精確投影，多個欄位時以 Dykstra 在各欄位間交替投影
+        '''
+        if len(self.groups) <= 1:
+            return self._project_simplex(v, self.groups[0] if self.groups else None)
+
+        corrections = [np.zeros_like(v) for _ in self.groups]
+        x = v
+        for _ in range(100):
+            previous = x
+            for i, group in enumerate(self.groups):
+                y = self._project_simplex(x + corrections[i], group)
+                corrections[i] = x + corrections[i] - y
+                x = y
+            if np.max(np.abs(x - previous)) < self.tolerance:
+                break
+        return x
+
+
+    def _project_simplex(self, v, group=None):
+        # 投影解為 wᵢ = clip(vᵢ - max(τ, τ_g), 0, 上限)，τ_g 只由該類別決定（_group_floor），
+        # 找 τ 使 f(τ) = Σw = 1；f 分段線性且遞減，以上次的 τ 為起點做牛頓法，跳出區間時改用二分法
+        floor = self._group_floor(v, group)
+        low, high = np.min(v - self.upper), np.max(v)
+        tau = min(max(self._tau, low), high)
+        for _ in range(100):
+            w = np.clip(v - np.maximum(tau, floor), 0, self.upper)
+            excess = w.sum() - 1
+            if abs(excess) < 1e-12:
+                break
+            if excess > 0:
+                low = tau
+            else:
+                high = tau
+            free = np.count_nonzero((w > 0) & (w < self.upper) & (floor < tau))
+            tau = tau + excess / free if free else (low + high) / 2
+            if not low <= tau <= high:
+                tau = (low + high) / 2
+        self._tau = tau
+        return w
+
+
+    def _group_floor(self, v, group):
+        # 每個生效的類別以二分法找 τ_g 使 Σ_g clip(v - τ_g, 0, 上限) = 類別上限，其餘基金為 -inf
+        floor = np.full(len(v), -np.inf)
+        if group is None:
+            return floor
+        index, local, starts, limit = group
+        values, upper = v[index], self.upper[index]
+        low = np.minimum.reduceat(values - upper, starts)
+        high = np.maximum.reduceat(values, starts)
+        while np.max(high - low) > 1e-13:
+            mid = (low + high) / 2
+            over = np.add.reduceat(np.clip(values - mid[local], 0, upper), starts) > limit
+            low = np.where(over, mid, low)
+            high = np.where(over, high, mid)
+        floor[index] = high[local]
+        return floor
+
+
+    def _active_set(self, gamma, mean, w, max_iter=200):
+        # primal-dual active set：依目前的 0 / 上限 / 類別上限 集合解等式限制的 KKT 系統，
+        # 再依解的可行性與乘數符號更新集合，集合不再變動即為精確解；未收斂回傳 None。
+        # 集合重複出現（循環）後改為每次只調整違反最多的一項
+        upper = self.upper
+        at_zero = (w <= 1e-12) | (upper <= 0)
+        at_upper = ~at_zero & (w >= upper - 1e-12)
+        binding = self.membership.T @ w >= self.cap_limit - 1e-9
+        seen, single = set(), False
+        for _ in range(max_iter):
+            free = np.flatnonzero(~at_zero & ~at_upper)
+            base = np.where(at_upper, upper, 0.0)
+            # 自由基金：γΣ_FF w_F = μ_F - γ(Σ·base)_F - τ - Σν_g，並滿足權重合計與生效的類別上限
+            constraints = np.column_stack([np.ones(len(free)), self.membership[free][:, binding]])
+            targets = np.r_[1 - base.sum(), self.cap_limit[binding] - self.membership[:, binding].T @ base]
+            rhs = (mean - gamma * self.covariance_dot(base))[free]
+            try:
+                solved = self._solve(free, gamma * self.shrinkage * self.var[free], gamma * (1 - self.shrinkage),
+                                     np.column_stack([rhs, constraints]))
+            except np.linalg.LinAlgError:
+                return None
+            multipliers = np.linalg.lstsq(constraints.T @ solved[:, 1:], constraints.T @ solved[:, 0] - targets, rcond=None)[0]
+            w = base.copy()
+            w[free] = solved[:, 0] - solved[:, 1:] @ multipliers
+            nu = np.zeros(len(self.cap_limit))
+            nu[binding] = multipliers[1:]
+
+            # 梯度殘差 r = γΣw - μ + τ + Σν_g：0 的基金 r ≥ 0、上限的基金 r ≤ 0 才是最適
+            residual = gamma * self.covariance_dot(w) - mean + multipliers[0] + self.membership @ nu
+            scale = 1e-10 * max(np.max(np.abs(residual)), 1e-12)
+            is_free = ~at_zero & ~at_upper
+            next_zero = (upper <= 0) | (is_free & (w < -1e-12)) | (at_zero & (residual > -scale))
+            next_upper = ~next_zero & ((is_free & (w > upper + 1e-12)) | (at_upper & (residual < scale)))
+            # 生效的類別沒有自由基金時無法滿足上限，改為釋放該類別在上限的基金
+            stuck = self.membership[:, binding & (self.membership.T @ w > self.cap_limit + 1e-12)].any(axis=1)
+            next_upper &= ~(stuck & at_upper)
+            next_binding = (binding & (nu > -scale)) | (~binding & (self.membership.T @ w > self.cap_limit + 1e-12))
+            if (np.array_equal(next_zero, at_zero) and np.array_equal(next_upper, at_upper)
+                    and np.array_equal(next_binding, binding)):
+                return np.clip(w, 0, upper)
+
+            state = (at_zero.tobytes(), at_upper.tobytes(), binding.tobytes())
+            single = single or state in seen
+            seen.add(state)
+            if single:
+                next_zero, next_upper, next_binding = self._single_change(
+                    w, residual, nu, is_free, at_zero, at_upper, binding, next_zero, next_upper, next_binding)
+            at_zero, at_upper, binding = next_zero, next_upper, next_binding
+        return None
+
+
+    def _single_change(self, w, residual, nu, is_free, at_zero, at_upper, binding, next_zero, next_upper, next_binding):
+        # 只保留一項集合變動：先修正權重或類別合計超出範圍最多的一項，沒有時再釋放乘數符號錯誤最多的一項
+        excess = np.where(is_free, np.maximum(-w, w - self.upper), -np.inf)
+        over = self.membership.T @ w - self.cap_limit
+        zero, upper, groups = at_zero.copy(), at_upper.copy(), binding.copy()
+        if max(excess.max(initial=-np.inf), over.max(initial=-np.inf)) > 1e-12:
+            if excess.max(initial=-np.inf) >= over.max(initial=-np.inf):
+                i = np.argmax(excess)
+                zero[i], upper[i] = next_zero[i], next_upper[i]
+            elif not binding[np.argmax(over)]:
+                groups[np.argmax(over)] = True
+            else:
+                # 已生效但仍超過上限：釋放該類別在上限、最想減碼（r 最大）的基金
+                members = (self.membership[:, np.argmax(over)] > 0) & at_upper
+                upper[np.argmax(np.where(members, residual, -np.inf))] = False
+            return zero, upper, groups
+
+        # 乘數違反：0 的基金 r < 0、上限的基金 r > 0、生效類別 ν < 0
+        dual = np.where(at_zero & (self.upper > 0), -residual, -np.inf)
+        dual = np.maximum(dual, np.where(at_upper, residual, -np.inf))
+        release = np.where(binding, -nu, -np.inf)
+        if dual.max(initial=-np.inf) >= release.max(initial=-np.inf):
+            i = np.argmax(dual)
+            zero[i], upper[i] = next_zero[i], next_upper[i]
+        else:
+            groups[np.argmax(release)] = False
+        return zero, upper, groups
+
+
+    def _solve(self, index, diagonal, scale, rhs):
+        # 解 (scale·X_Iᵀ X_I + diag(diagonal)) z = rhs；基金數多於天數時以 Woodbury 轉成 (天數 × 天數) 的系統
+        x = self.x[:, index]
+        if len(index) <= x.shape[0]:
+            return np.linalg.solve(scale * x.T @ x + np.diag(diagonal), rhs)
+        if np.any(diagonal <= 0):
+            raise np.linalg.LinAlgError('對角項必須為正（shrinkage 需大於 0）')
+        scaled = rhs / (diagonal[:, None] if rhs.ndim > 1 else diagonal)
+        inner = np.eye(x.shape[0]) / scale + (x / diagonal) @ x.T
+        correction = x.T @ np.linalg.solve(inner, x @ scaled)
+        return scaled - correction / (diagonal[:, None] if rhs.ndim > 1 else diagonal)
+
+
+    def _max_return(self):
+        # 報酬越高的基金越先填滿上限（線性規劃在盒型限制下的解），再投影到類別上限
+        w = np.zeros_like(self.mean)
+        remaining = 1.0
+        for i in np.argsort(-self.mean):
+            if remaining <= 0:
+                break
+            w[i] = min(self.upper[i], remaining)
+            remaining -= w[i]
+        return self.project(w)
+
+
+    def _max_eigenvalue(self, iterations=100):
+        # 冪次法估計 Σ 的最大特徵值（梯度的 Lipschitz 常數）
+        w = np.random.default_rng(0).random(len(self.codes))
+        value = 1.0
+        for _ in range(iterations):
+            w_next = self.covariance_dot(w)
+            value = np.linalg.norm(w_next)
+            if value == 0:
+                return 1.0
+            w = w_next / value
+        return value
+
+
+    def _describe(self, weights):
+        variance = (1 - self.shrinkage) * ((weights @ self.x.T) ** 2).sum(axis=1) + self.shrinkage * (weights ** 2) @ self.var
+        risk = np.sqrt(variance)
+        expected = weights @ self.mean
+        return pd.DataFrame({
+            '預期報酬': expected,
+            '風險': risk,
+            '年化報酬': expected * self.periods_per_year,
+            '年化風險': risk * np.sqrt(self.periods_per_year),
+            '持有檔數': np.count_nonzero(weights > 1e-6, axis=1),
+        })
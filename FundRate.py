@@ -7,15 +7,32 @@ import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
+from functools import partial
+from contextlib import nullcontext
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from FundMetrics import FundMetrics
+from FundExport import FundExport
 
 
 
 
+# 目前的協程是否已持有共用 semaphore 的名額（重試時的握手不再重複取得，避免死結）
+holding_slot = ContextVar('holding_slot', default=False)
+# 解析與合併共用單一執行緒：多個執行緒同時爭用 GIL 時，事件迴圈很難取回 GIL，查詢會卡住
+parse_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
+
+
 class FundRate:
 
-    def __init__(self, company=""):
+    def __init__(self, company="", metrics=None):
         warnings.filterwarnings("ignore", message="Unverified HTTPS request")
         self.company = company
+        self.metrics = metrics or FundMetrics('FundRate')
+        self.exporter = FundExport()
+        self.session = None  # 服務模式共用的常駐連線池（FundService）
+        self.semaphore = None  # 排程器共用的同時請求上限（FundJobs / FundService）
+        self.post_dict = None
 
         self.rate_url = "https://www.sitca.org.tw/ROC/Industry/IN2213.aspx?pid=IN2222_03"
         self.headers = {
@@ -24,11 +41,30 @@ class FundRate:
         }
 
 
+    async def run_parser(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(parse_executor, partial(func, *args, **kwargs))
+
+
+    def client_session(self, headers=None):
+        # 有常駐的連線池時直接共用，否則每次建立新的 session
+        if self.session is not None and not self.session.closed:
+            return nullcontext(self.session)
+        return aiohttp.ClientSession(headers=headers)
+
+
+    def request_slot(self):
+        # 握手的請求也計入共用的同時請求數
+        if self.semaphore is None or holding_slot.get():
+            return nullcontext()
+        return self.semaphore
+
+
     async def get_post(self, url, post_dict=None):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=self.headers, data=post_dict, verify_ssl=False) as response:
-                    html = await response.text()
+            async with self.client_session() as session, self.request_slot():
+                with self.metrics.stage('token'):
+                    async with session.post(url, headers=self.headers, data=post_dict, verify_ssl=False) as response:
+                        html = await response.text()
 
                 soup = BeautifulSoup(html, 'html.parser')
 
@@ -49,23 +85,33 @@ class FundRate:
 
     async def fetch_data(self, session, date_str):
         self.post_dict['ctl00$ContentPlaceHolder1$ddlQ_YM'] = date_str
+        self.metrics.count('requests')
         try:
-            async with session.post(self.rate_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
-                response_text = await response.text()
-                print(f'{date_str}下載完畢')
-                return response_text
+            with self.metrics.stage('fetch', date=date_str):
+                async with session.post(self.rate_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
+                    body = await response.read()
+                    response_text = await response.text()
+            self.metrics.count('bytes', len(body))
+            print(f'{date_str}下載完畢')
+            return response_text
             
         except Exception as e:
+            self.metrics.count('retries')
             self.post_dict = await self.get_post(self.rate_url)
             if not self.post_dict:
+                self.metrics.count('failures')
                 return None
             self.post_dict['ctl00$ContentPlaceHolder1$ddlQ_YM'] = date_str
             try:
-                async with session.post(self.rate_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
-                    response_text = await response.text()
-                    print(f'{date_str}再次嘗試下載')
-                    return response_text
+                with self.metrics.stage('fetch', date=date_str, retry=True):
+                    async with session.post(self.rate_url, headers=self.headers, data=self.post_dict, verify_ssl=False) as response:
+                        body = await response.read()
+                        response_text = await response.text()
+                self.metrics.count('bytes', len(body))
+                print(f'{date_str}再次嘗試下載')
+                return response_text
             except Exception as e:
+                self.metrics.count('failures')
                 print(f"無法取得 {date_str} 的資料：{str(e)}")
                 return None
 
@@ -73,16 +119,25 @@ class FundRate:
     async def download_data(self, session, date):
         response_text = await self.fetch_data(session, date)
         if response_text:
-            soup = BeautifulSoup(response_text, "html.parser")
-            return await self.parse_data(soup)  # 直接返回異步處理對象
+            # 解析在執行緒中進行，常駐服務（FundService）下載期間事件迴圈仍能回應查詢
+            return await self.run_parser(self.parse_page, response_text, date)
         else:
             return pd.DataFrame()
 
 
-    async def range_main(self, date_df, headers):
-        self.post_dict = await self.get_post(self.rate_url)
-        async with aiohttp.ClientSession(headers=headers) as session:
-            semaphore = asyncio.Semaphore(len(date_df))  
+    def parse_page(self, response_text, date):
+        with self.metrics.stage('parse', date=date):
+            soup = BeautifulSoup(response_text, "html.parser")
+            return self.parse_data(soup)
+
+
+    async def range_main(self, date_df, headers, semaphore=None):
+        # 未指定時不限制並發；由排程器共用同一個 semaphore 控制總請求量（含握手）
+        self.semaphore = semaphore = semaphore or asyncio.Semaphore(max(len(date_df), 1))
+        # 常駐連線池沿用上次的請求碼，失效時由 fetch_data 重新取得
+        if self.session is None or not self.post_dict:
+            self.post_dict = await self.get_post(self.rate_url)
+        async with self.client_session(headers) as session:
             tasks = [self.download_data_with_semaphore(session, date, semaphore) for date in date_df]
             results = await asyncio.gather(*tasks)
             result_df = pd.DataFrame()
@@ -93,10 +148,14 @@ class FundRate:
 
     async def download_data_with_semaphore(self, session, date, semaphore):
         async with semaphore:
-            return await self.download_data(session, date)
+            token = holding_slot.set(True)
+            try:
+                return await self.download_data(session, date)
+            finally:
+                holding_slot.reset(token)
 
         
-    async def parse_data(self, soup):
+    def parse_data(self, soup):
         fund_dict = {'基金統編': [], '除息日': [], '股利率': []}
         table = soup.find('table')
         if table:
@@ -113,29 +172,36 @@ class FundRate:
 
     async def process_result(self, date, result_df, result):
         if result.empty:
-            return
+            return result_df
         else:
             result.rename(columns={'除息日': f"{date}_date"}, inplace=True)
             result.rename(columns={'股利率': f"{date}_rate"}, inplace=True)
             
-        if result_df.empty:
-            result_df = result
-        else:
-            result_df = result_df.merge(result, how='left', on='基金統編')
+        with self.metrics.stage('merge', date=date):
+            if result_df.empty:
+                result_df = result
+            else:
+                # 各月份配息的基金不同，以 outer 合併保留之後才開始配息的基金
+                result_df = await self.run_parser(result_df.merge, result, how='outer', on='基金統編')
             
         print(f'result_df: \n{result_df.info()}')
         return result_df
         
         
-    def run(self, start_date, end_date):
-        self.post_dict = asyncio.run(self.get_post(self.rate_url))
+    async def run_async(self, start_date, end_date, semaphore=None):
         # 生成月份範圍
         date_df = pd.date_range(start_date, end_date, freq='MS').strftime("%Y%m")
         print(f'總請求筆數: {len(date_df)}筆')
         print(f'date_df: \n{date_df}筆')
 
-        result_df = asyncio.run(self.range_main(date_df, self.headers))
-        result_df.to_excel(f'test_df.xlsx')
+        # range_main 會先取得請求碼，同一個事件迴圈內完成全部請求
+        return await self.range_main(date_df, self.headers, semaphore)
+
+
+    def run(self, start_date, end_date, file_name='test_df.xlsx'):
+        result_df = asyncio.run(self.run_async(start_date, end_date))
+        with self.metrics.stage('write', rows=len(result_df)):
+            self.exporter.write(result_df, file_name)
         return result_df
         
         
@@ -149,6 +215,7 @@ if __name__ == "__main__":
     end_date = "20240420"
     result_df = fond_rate.run(start_date, end_date)
     print(result_df.info())
+    fond_rate.metrics.report()
 
 
 
@@ -0,0 +1,413 @@
+import os
+import gc
+import json
+import time
+import asyncio
+import aiohttp
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from functools import partial
+from FundMetrics import FundMetrics
+from FundExport import FundExport
+from FundDownloader import FundDownloader
+from FundRate import FundRate
+from TotalReturn import TotalReturn
+
+
+class FundService:
+    '''
+    ## FundService
+    ### 常駐服務：保留連線池、請求碼、基金基本資料與歷史漲跌在記憶體中，定時補抓新的營業日與配息，並以本機 HTTP/JSON API 回應查詢。
+
+    ### 方法：
+    - open / close: 建立與關閉 FundDownloader、FundRate 共用的連線池，並讀入歷史檔與配息檔。
+    - refresh: 補抓尚未取得的營業日與最近兩個月的配息，重建查詢索引。
+    - fund / history / dividends / statistics / health: 查詢（只讀取記憶體中的索引）。
+    - app / run: 建立 aiohttp 應用程式並啟動服務。
+
+    ### API：
+    - GET /health: 服務狀態、基金數、資料期間、上次更新時間
+    - GET /metrics: Prometheus 文字格式的指標（下載各階段與查詢耗時）
+    - GET /funds/{基金統編}: 基本資料與平均值、標準差
+    - GET /funds/{基金統編}/history?start=2024-01-01&end=2024-03-31: 每日漲跌
+    - GET /funds/{基金統編}/dividends: 除息日與股利率
+    - GET /statistics?風險等級=RR3,RR4&範圍=全球&sort=平均值&ascending=false&limit=100: 篩選後的統計表
+    - POST /refresh: 立即更新
+
+    ### 例子：
+    python FundService.py --start 20230520 --port 8080 --history 基金資料.parquet
+    curl http://127.0.0.1:8080/funds/ACTI71/history?start=2024-01-01
+    '''
+
+    def __init__(self, start_date, company="", refresh_interval=3600, history_file=None, concurrency=16, metrics=None,
+                 holiday_refreshes=3):
+        '''
+        - start_date: str, 歷史資料的起始日
+        - refresh_interval: int, 定時更新的間隔（秒）
+        - history_file: str, 啟動時讀入、更新後寫回的歷史檔（xlsx / csv / parquet），None 則只保留在記憶體；配息另存為 {檔名}_配息{副檔名}
+        - concurrency: int, 連線池大小與同時送出的請求數
+        - holiday_refreshes: int, 過去的營業日在幾次有收到資料的更新中都沒有資料，才視為休市不再下載
+        '''
+        self.start_date = start_date
+        self.refresh_interval = refresh_interval
+        self.history_file = history_file
+        self.concurrency = concurrency
+        self.holiday_refreshes = holiday_refreshes
+        self.rate_file = None
+        if history_file:
+            root, ext = os.path.splitext(history_file)
+            self.rate_file = f'{root}_配息{ext}'
+        self.metrics = metrics or FundMetrics('FundService')
+        self.downloader = FundDownloader(company, self.metrics)
+        self.rate = FundRate(company, self.metrics)
+
+        self.history_df = pd.DataFrame()  # 基本資料 + 日期欄（不含統計欄）
+        self.rate_df = pd.DataFrame()
+        self.state = None                 # 查詢用的索引，每次更新後整個替換
+        self.empty_counts = {}            # 過去營業日 -> 沒有資料的更新次數
+        self.empty_dates = set()          # 已確認沒有資料的過去營業日
+        self.last_refresh = None
+        self.started = time.time()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.refresh_task = None
+
+
+    async def open(self):
+        session = aiohttp.ClientSession(headers=self.downloader.headers,
+                                        connector=aiohttp.TCPConnector(limit=self.concurrency))
+        self.downloader.session = session
+        self.rate.session = session
+        if self.rate_file and os.path.exists(self.rate_file):
+            with self.metrics.stage('read'):
+                self.rate_df = await asyncio.to_thread(self._read_table, self.rate_file, str)
+        if self.history_file and os.path.exists(self.history_file):
+            with self.metrics.stage('read'):
+                self.history_df = await asyncio.to_thread(self._read, self.history_file)
+            self.state = await asyncio.to_thread(self._build, self.history_df, self.rate_df)
+            print(f'已讀入 {self.history_file}：{len(self.history_df)} 檔基金')
+        # 啟動時載入的模組與歷史資料移出 gc 的掃描範圍：解析頁面時頻繁的完整回收會持有 GIL，讓查詢卡住數十毫秒
+        gc.collect()
+        gc.freeze()
+
+
+    async def close(self):
+        if self.downloader.session is not None:
+            await self.downloader.session.close()
+        self.downloader.session = self.rate.session = None
+
+
+    async def refresh(self):
+        '''
+        ### 補抓缺少的營業日與最近兩個月的配息；新的索引建好後才替換，查詢不會看到一半的資料
+        ### 頁面解析、合併與建立索引都在執行緒中進行，更新期間查詢仍由事件迴圈即時回應
+        '''
+        async with self.lock:
+            today = pd.Timestamp.today().normalize()
+            # 跨日後重新下載基本資料（新基金、風險等級異動）
+            if self.last_refresh is not None and self.last_refresh.normalize() != today:
+                self.downloader.cache.pop('basic', None)
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            known = set(self._date_columns(self.history_df))
+            dates = pd.DatetimeIndex([date for date in pd.date_range(self.start_date, today, freq='B')
+                                      if date.strftime('%Y-%m-%d') not in known and date not in self.empty_dates])
+            history_df = self.history_df
+            if len(dates):
+                new_df = await self.downloader.range_main(dates, self.downloader.headers, semaphore)
+                received = set(self._date_columns(new_df))
+                if received:
+                    self._count_empty(dates, received, today)
+                    history_df = new_df if history_df.empty else self.downloader.merge_df(history_df, new_df)
+                else:
+                    # 全部沒有資料可能是請求碼失效，下次更新重新取得
+                    self.downloader.post_dict = None
+
+            months = pd.date_range(self.start_date if self.rate_df.empty else (today - pd.DateOffset(months=1)).replace(day=1),
+                                   today, freq='MS').strftime('%Y%m')
+            rate_df = self._merge_rate(self.rate_df, await self.rate.range_main(months, self.rate.headers, semaphore))
+
+            with self.metrics.stage('index', rows=len(history_df)):
+                self.state = await asyncio.to_thread(self._build, history_df, rate_df)
+            changed = history_df is not self.history_df
+            rate_changed = rate_df is not self.rate_df
+            self.history_df, self.rate_df = history_df, rate_df
+            self.last_refresh = pd.Timestamp.now()
+            self.metrics.count('refreshes')
+
+            if changed and self.history_file:
+                with self.metrics.stage('write', rows=len(history_df)):
+                    await asyncio.to_thread(self.downloader.exporter.write, self.state['summary_df'].join(
+                        history_df[self._date_columns(history_df)]), self.history_file)
+            if rate_changed and self.rate_file:
+                with self.metrics.stage('write', rows=len(rate_df)):
+                    await asyncio.to_thread(self.downloader.exporter.write, rate_df, self.rate_file)
+
+
+    def _count_empty(self, dates, received, today):
+        # 單次沒有資料可能是暫時的錯誤；過去的營業日連續 holiday_refreshes 次都沒有資料才視為休市，今天的淨值可能還沒公布不計
+        for date in dates:
+            if date.strftime('%Y-%m-%d') in received:
+                self.empty_counts.pop(date, None)
+            elif date < today:
+                self.empty_counts[date] = self.empty_counts.get(date, 0) + 1
+                if self.empty_counts[date] >= self.holiday_refreshes:
+                    self.empty_dates.add(date)
+                    del self.empty_counts[date]
+
+
+    def _build(self, history_df, rate_df):
+        # 查詢索引：基金統編 -> 列位置、排序後的日期、漲跌矩陣、統計表、配息事件
+        if history_df.empty:
+            return None
+        stats_df = self.downloader.get_statistics(history_df.copy())
+        returns = FundDownloader.return_matrix(stats_df)
+        codes = returns.index.to_numpy()
+        index = {}
+        for i, code in enumerate(codes):
+            index.setdefault(code, i)
+
+        dividends = {}
+        if not rate_df.empty:
+            events = TotalReturn().dividend_events(rate_df)
+            events['除息日'] = events['除息日'].dt.strftime('%Y-%m-%d')
+            events['股利率'] = (events['股利率'] * 100).round(6)
+            for code, group in events.groupby('基金統編'):
+                dividends[code] = group[['除息日', '股利率']].to_dict('records')
+
+        return {
+            'index': index,
+            'dates': returns.columns.strftime('%Y-%m-%d').to_numpy(),
+            'values': returns.to_numpy(dtype=float),
+            'summary_df': stats_df[FundExport.meta_columns + FundExport.stat_columns],
+            'dividends': dividends,
+        }
+
+
+    # ---------- 查詢 ----------
+
+    def fund(self, code):
+        state = self.state
+        if state is None or code not in state['index']:
+            return None
+        return self._records(state['summary_df'].iloc[[state['index'][code]]])[0]
+
+
+    def history(self, code, start=None, end=None):
+        state = self.state
+        if state is None or code not in state['index']:
+            return None
+        dates = state['dates']
+        start, end = (pd.Timestamp(date).strftime('%Y-%m-%d') if date else None for date in (start, end))
+        left = np.searchsorted(dates, start, side='left') if start else 0
+        right = np.searchsorted(dates, end, side='right') if end else len(dates)
+        values = state['values'][state['index'][code], left:right]
+        return {'基金統編': code, '日期': dates[left:right].tolist(),
+                '漲跌': np.where(np.isnan(values), None, values).tolist()}
+
+
+    def dividends(self, code):
+        state = self.state
+        if state is None or code not in state['index']:
+            return None
+        return {'基金統編': code, '配息': state['dividends'].get(code, [])}
+
+
+    def statistics(self, filters=None, sort='平均值', ascending=False, limit=100):
+        '''
+        ### 依基本資料欄位篩選（每個欄位可給多個值），排序後回傳前 limit 筆
+        '''
+        if self.state is None:
+            return None
+        summary_df = self.state['summary_df']
+        mask = np.ones(len(summary_df), dtype=bool)
+        for column, values in (filters or {}).items():
+            mask &= summary_df[column].isin(values).to_numpy()
+        result_df = summary_df[mask].sort_values(sort, ascending=ascending).head(limit)
+        return {'筆數': int(mask.sum()), '資料': self._records(result_df)}
+
+
+    def health(self):
+        state = self.state
+        return {
+            'status': 'ok' if state is not None else 'loading',
+            'funds': len(state['index']) if state else 0,
+            'start': state['dates'][0] if state and len(state['dates']) else None,
+            'end': state['dates'][-1] if state and len(state['dates']) else None,
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh is not None else None,
+            'refreshing': self.lock.locked(),
+            'uptime': round(time.time() - self.started, 1),
+        }
+
+
+    # ---------- HTTP ----------
+
+    def app(self):
+        app = web.Application(middlewares=[self._timing])
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/statistics', self.handle_statistics)
+        app.router.add_get('/funds/{code}', self.handle_fund)
+        app.router.add_get('/funds/{code}/history', self.handle_history)
+        app.router.add_get('/funds/{code}/dividends', self.handle_dividends)
+        app.router.add_post('/refresh', self.handle_refresh)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+
+    def run(self, host='127.0.0.1', port=8080):
+        web.run_app(self.app(), host=host, port=port)
+
+
+    @web.middleware
+    async def _timing(self, request, handler):
+        with self.metrics.stage('query', path=request.path):
+            return await handler(request)
+
+
+    async def handle_health(self, request):
+        return self._json(self.health())
+
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.metrics.to_prometheus(), content_type='text/plain')
+
+
+    async def handle_fund(self, request):
+        return self._json(self.fund(request.match_info['code']))
+
+
+    async def handle_history(self, request):
+        query = request.query
+        try:
+            history = self.history(request.match_info['code'], query.get('start'), query.get('end'))
+        except ValueError:
+            raise web.HTTPBadRequest(text='start / end 必須是日期，例如 2024-01-31')
+        return self._json(history)
+
+
+    async def handle_dividends(self, request):
+        return self._json(self.dividends(request.match_info['code']))
+
+
+    async def handle_statistics(self, request):
+        query = request.query
+        columns = FundExport.meta_columns + FundExport.stat_columns
+        sort = query.get('sort', '平均值')
+        if sort not in columns:
+            raise web.HTTPBadRequest(text=f'sort 必須是 {columns} 之一')
+        try:
+            limit = int(query.get('limit', 100))
+        except ValueError:
+            raise web.HTTPBadRequest(text='limit 必須是整數')
+        filters = {column: query[column].split(',') for column in FundExport.meta_columns if column in query}
+        ascending = query.get('ascending', 'false').lower() == 'true'
+        return self._json(self.statistics(filters, sort, ascending, limit))
+
+
+    async def handle_refresh(self, request):
+        # 保留任務的參考，避免執行中被回收；失敗與定時更新一樣計入 refresh_failures
+        if not self.lock.locked() and (self.refresh_task is None or self.refresh_task.done()):
+            self.refresh_task = asyncio.create_task(self._refresh_once())
+        return self._json({'status': 'refreshing'}, status=202)
+
+
+    def _json(self, data, status=200):
+        if data is None:
+            if self.state is None:
+                raise web.HTTPServiceUnavailable(text='資料載入中')
+            raise web.HTTPNotFound(text='找不到基金')
+        return web.json_response(data, status=status, dumps=partial(json.dumps, ensure_ascii=False))
+
+
+    async def _on_startup(self, app):
+        await self.open()
+        self.task = asyncio.create_task(self._refresh_loop())
+
+
+    async def _on_cleanup(self, app):
+        for task in (self.task, self.refresh_task):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        await self.close()
+
+
+    async def _refresh_loop(self):
+        while True:
+            await self._refresh_once()
+            await asyncio.sleep(self.refresh_interval)
+
+
+    async def _refresh_once(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.metrics.count('refresh_failures')
+            print(f'更新失敗：{e}')
+
+
+    # ---------- 工具 ----------
+
+    @staticmethod
+    def _date_columns(df):
+        return [col for col in df.columns if col not in FundExport.meta_columns + FundExport.stat_columns]
+
+
+    @staticmethod
+    def _merge_rate(rate_df, new_df):
+        # 重新下載的月份以新資料取代
+        if new_df.empty:
+            return rate_df
+        if rate_df.empty:
+            return new_df
+        rate_df = rate_df.drop(columns=[col for col in new_df.columns if col != '基金統編' and col in rate_df.columns])
+        return rate_df.merge(new_df, how='outer', on='基金統編')
+
+
+    def _read(self, path):
+        df = self._read_table(path, {'基金統編': str})
+        df = df.drop(columns=[col for col in FundExport.stat_columns if col in df.columns])
+        # 舊版合併在基本資料異動時會把同一檔基金拆成多列：日期欄取非空值，基本資料取最後一列
+        if df['基金統編'].duplicated().any():
+            df = df.groupby('基金統編', sort=False, as_index=False).last()
+        return df
+
+
+    @staticmethod
+    def _read_table(path, dtype):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        if path.endswith('.csv'):
+            return pd.read_csv(path, encoding='utf-8-sig', dtype=dtype)
+        return pd.read_excel(path, dtype=dtype)
+
+
+    @staticmethod
+    def _records(df):
+        return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='基金資料常駐服務')
+    parser.add_argument('--start', default=(pd.Timestamp.today() - pd.DateOffset(years=1)).strftime('%Y%m%d'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--interval', type=int, default=3600)
+    parser.add_argument('--history')
+    parser.add_argument('--company', default="")
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    fund_service = FundService(args.start, args.company, args.interval, args.history, args.concurrency)
+    fund_service.run(args.host, args.port)
+    fund_service.metrics.report()
@@ -0,0 +1,182 @@
+import os
+import json
+import asyncio
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from FundExport import FundExport
+from FundDownloader import FundDownloader
+
+
+class FundShard:
+    '''
+    ## FundShard
+    ### 將長期回補切成多個日期分片，每個分片在獨立行程（各自的事件迴圈與連線池）中下載，寫成分片檔後再以固定順序合併。
+
+    ### 方法：
+    - plan: 將日期區間切成分片規格（可存成 JSON，交給其他機器執行）。
+    - run_shard: 執行單一分片並寫出分片檔。
+    - merge: 依分片順序讀回分片檔，合併並計算統計值。
+    - run: 在本機以多行程執行所有分片並合併。
+
+    ### 例子：
+    shard = FundShard(out_dir='shards')
+    result_df = shard.run("20200101", "20231231", shards=8)
+
+    #### 跨機器執行
+    python FundShard.py plan 20200101 20231231 --shards 8 --plan plan.json
+    python FundShard.py run-shard plan.json 0      # 每台機器各自執行一個分片
+    python FundShard.py merge plan.json            # 分片檔收齊後合併
+    '''
+
+    def __init__(self, out_dir='shards', company="", file_type='parquet', concurrency=16):
+        '''
+        - out_dir: str, 分片檔輸出資料夾
+        - file_type: str, 分片檔格式（parquet / csv）
+        - concurrency: int, 每個分片同時送出的請求數
+        '''
+        self.out_dir = out_dir
+        self.company = company
+        self.file_type = file_type
+        self.concurrency = concurrency
+
+
+    def plan(self, start_date, end_date, shards=None):
+        '''
+        ### 將營業日切成連續的分片
+        - shards: int, 分片數（預設為 CPU 核心數）
+        '''
+        dates = pd.date_range(start_date, end_date, freq='B')
+        if dates.empty:
+            return []
+        shards = max(1, min(shards or os.cpu_count() or 1, len(dates)))
+        bounds = [round(i * len(dates) / shards) for i in range(shards + 1)]
+
+        specs = []
+        for i in range(shards):
+            shard_dates = dates[bounds[i]:bounds[i + 1]]
+            specs.append({
+                'shard': i,
+                'company': self.company,
+                'dates': shard_dates.strftime('%Y-%m-%d').tolist(),
+                'concurrency': self.concurrency,
+                'output': os.path.join(self.out_dir, f'shard_{i:04d}_{shard_dates[0]:%Y%m%d}-{shard_dates[-1]:%Y%m%d}.{self.file_type}'),
+            })
+        return specs
+
+
+    @staticmethod
+    def run_shard(spec):
+        '''
+        ### 執行單一分片：下載 spec['dates'] 並寫到 spec['output']
+        '''
+        fund_downloader = FundDownloader(spec.get('company', ""))
+        date_df = pd.to_datetime(spec['dates'])
+
+        async def main():
+            semaphore = asyncio.Semaphore(spec.get('concurrency', len(date_df)))
+            return await fund_downloader.range_main(date_df, fund_downloader.headers, semaphore)
+
+        result_df = asyncio.run(main())
+        os.makedirs(os.path.dirname(spec['output']) or '.', exist_ok=True)
+        FundExport().write(result_df, spec['output'])
+        print(f"分片 {spec['shard']} 完成: {spec['dates'][0]} - {spec['dates'][-1]}")
+        return spec['output']
+
+
+    def merge(self, specs):
+        '''
+        ### 依分片編號合併分片檔，結果與分片執行順序無關
+        '''
+        fund_downloader = FundDownloader(self.company)
+        result_df = None
+        for spec in sorted(specs, key=lambda spec: spec['shard']):
+            part = self._read(spec['output'])
+            if part.empty:
+                continue
+            result_df = part if result_df is None else fund_downloader.merge_df(result_df, part)
+
+        if result_df is None:
+            return pd.DataFrame()
+        meta_columns = FundExport.meta_columns
+        result_df = result_df[meta_columns + sorted(col for col in result_df.columns if col not in meta_columns)]
+        result_df = result_df.sort_values('基金統編', kind='stable', ignore_index=True)
+        return fund_downloader.get_statistics(result_df)
+
+
+    def run(self, start_date, end_date, shards=None, workers=None, to_excel=False):
+        specs = self.plan(start_date, end_date, shards)
+        print(f'分片數: {len(specs)}')
+        with ProcessPoolExecutor(max_workers=workers or len(specs)) as executor:
+            list(executor.map(FundShard.run_shard, specs))
+
+        result_df = self.merge(specs)
+        if to_excel:
+            FundExport().write(result_df, f'{start_date}-{end_date}基金資料.xlsx')
+        return result_df
+
+
+    def _read(self, path):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        return pd.read_csv(path, dtype={'基金統編': str}, encoding='utf-8-sig')
+
+
+    @staticmethod
+    def save_plan(specs, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(specs, f, ensure_ascii=False, indent=2)
+        print(f'分片規格已保存到 {path}')
+
+
+    @staticmethod
+    def load_plan(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='分片回補基金資料')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = sub.add_parser('plan')
+    plan_parser.add_argument('start_date')
+    plan_parser.add_argument('end_date')
+    plan_parser.add_argument('--shards', type=int)
+    plan_parser.add_argument('--plan', default='plan.json')
+    plan_parser.add_argument('--out-dir', default='shards')
+    plan_parser.add_argument('--file-type', default='parquet')
+
+    shard_parser = sub.add_parser('run-shard')
+    shard_parser.add_argument('plan')
+    shard_parser.add_argument('shard', type=int)
+
+    merge_parser = sub.add_parser('merge')
+    merge_parser.add_argument('plan')
+    merge_parser.add_argument('--output', default='基金資料.xlsx')
+
+    run_parser = sub.add_parser('run')
+    run_parser.add_argument('start_date')
+    run_parser.add_argument('end_date')
+    run_parser.add_argument('--shards', type=int)
+    run_parser.add_argument('--workers', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        fund_shard = FundShard(out_dir=args.out_dir, file_type=args.file_type)
+        FundShard.save_plan(fund_shard.plan(args.start_date, args.end_date, args.shards), args.plan)
+    elif args.command == 'run-shard':
+        specs = FundShard.load_plan(args.plan)
+        FundShard.run_shard(next(spec for spec in specs if spec['shard'] == args.shard))
+    elif args.command == 'merge':
+        result_df = FundShard().merge(FundShard.load_plan(args.plan))
+        FundExport().write(result_df, args.output)
+        print(result_df.info())
+    else:
+        result_df = FundShard().run(args.start_date, args.end_date, args.shards, args.workers, to_excel=True)
+        print(result_df.info())
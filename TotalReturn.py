@@ -0,0 +1,138 @@
+import re
+import numpy as np
+import pandas as pd
+from FundDownloader import FundDownloader
+
+
+class TotalReturn:
+    '''
+    ## TotalReturn
+    ### 將 FundRate 的除息日與股利率對齊 FundDownloader 的每日漲跌，將配息再投入計算總報酬。
+
+    ### 方法：
+    - dividend_events: 將 FundRate 的寬表整理成 (基金統編, 除息日, 股利率) 事件表。
+    - dividend_matrix: 以 searchsorted 將配息事件對齊到 (基金 × 日期) 矩陣。
+    - total_return_index: 計算配息再投入後的總報酬指數。
+    - summary: 計算每檔基金的價格報酬、配息報酬、總報酬與年化報酬。
+
+    ### 假設：
+    - 漲跌與股利率皆為百分比；股利率為單次配息相對前一日淨值的比率。
+    - 除息日若非營業日，配息計入其後第一個有資料的日期。
+
+    ### 例子：
+    fund_df = FundDownloader().run_range("20230520", "20240520")
+    rate_df = FundRate().run("20230520", "20240520")
+    tr = TotalReturn()
+    index_df = tr.total_return_index(fund_df, rate_df)
+    summary_df = tr.summary(fund_df, rate_df)
+    '''
+
+    def __init__(self, periods_per_year=252):
+        '''
+        - periods_per_year: int, 年化時每年的交易日數
+        '''
+        self.periods_per_year = periods_per_year
+
+
+    def dividend_events(self, rate_df):
+        '''
+        ### 將 {年月}_date / {年月}_rate 欄位轉成事件表
+        '''
+        frames = []
+        for col in rate_df.columns:
+            match = re.match(r'^(\d{6})_date$', str(col))
+            if match and f'{match.group(1)}_rate' in rate_df.columns:
+                frames.append(pd.DataFrame({
+                    '基金統編': rate_df['基金統編'].astype(str).str.strip(),
+                    '除息日': rate_df[col],
+                    '股利率': rate_df[f'{match.group(1)}_rate'],
+                }))
+        if not frames:
+            return pd.DataFrame({'基金統編': [], '除息日': pd.to_datetime([]), '股利率': []})
+
+        events = pd.concat(frames, ignore_index=True)
+        events['除息日'] = self._parse_dates(events['除息日'])
+        events['股利率'] = pd.to_numeric(events['股利率'].astype(str).str.replace(',', ''), errors='coerce') / 100
+        events = events.dropna().drop_duplicates(['基金統編', '除息日'])
+        return events.sort_values(['基金統編', '除息日'], ignore_index=True)
+
+
+    def dividend_matrix(self, returns, events):
+        '''
+        ### 將配息事件對齊到漲跌矩陣
+        - returns: DataFrame, FundDownloader.return_matrix 的結果
+        - events: DataFrame, dividend_events 的結果
+        '''
+        codes = returns.index.to_numpy(dtype=str)
+        dates = returns.columns.to_numpy(dtype='datetime64[ns]')
+        dividends = np.zeros(returns.shape)
+        if events.empty or len(dates) == 0:
+            return dividends
+
+        # 基金統編：排序後以 searchsorted 查位置
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        event_codes = events['基金統編'].to_numpy(dtype=str)
+        code_pos = np.searchsorted(sorted_codes, event_codes).clip(max=len(codes) - 1)
+        code_ok = sorted_codes[code_pos] == event_codes
+
+        # 除息日：落在第一個 >= 除息日的交易日
+        event_dates = events['除息日'].to_numpy(dtype='datetime64[ns]')
+        date_pos = np.searchsorted(dates, event_dates, side='left')
+        date_ok = (event_dates >= dates[0]) & (date_pos < len(dates))
+
+        valid = code_ok & date_ok
+        np.add.at(dividends, (order[code_pos[valid]], date_pos[valid]), events['股利率'].to_numpy()[valid])
+        return dividends
+
+
+    def total_return_index(self, result_df, rate_df):
+        '''
+        ### 配息再投入後的總報酬指數（起始為 1）
+        '''
+        returns = FundDownloader.return_matrix(result_df)
+        dividends = self.dividend_matrix(returns, self.dividend_events(rate_df))
+        price = np.nan_to_num(returns.to_numpy() / 100)
+        index = np.cumprod(1 + price + dividends, axis=1)
+        return pd.DataFrame(index, index=returns.index, columns=returns.columns)
+
+
+    def summary(self, result_df, rate_df):
+        '''
+        ### 每檔基金的報酬摘要
+        '''
+        returns = FundDownloader.return_matrix(result_df)
+        dividends = self.dividend_matrix(returns, self.dividend_events(rate_df))
+        values = returns.to_numpy() / 100
+        price = np.nan_to_num(values)
+
+        periods = np.count_nonzero(~np.isnan(values), axis=1)
+        price_growth = np.prod(1 + price, axis=1)
+        total_growth = np.prod(1 + price + dividends, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annualized = np.where(periods > 0, total_growth ** (self.periods_per_year / periods) - 1, np.nan)
+
+        summary_df = pd.DataFrame({
+            '基金統編': returns.index,
+            '價格報酬': price_growth - 1,
+            '配息報酬': total_growth - price_growth,
+            '總報酬': total_growth - 1,
+            '年化報酬': annualized,
+            '配息次數': np.count_nonzero(dividends, axis=1),
+        })
+        if '基金名稱' in result_df.columns:
+            summary_df.insert(1, '基金名稱', result_df['基金名稱'].to_numpy())
+        return summary_df
+
+
+    @staticmethod
+    def _parse_dates(values):
+        # 支援 2023/05/17、112/05/17（民國年）與 20230517
+        parts = values.astype(str).str.extract(r'^\s*(\d{2,4})\D?(\d{1,2})\D?(\d{1,2})')
+        year = pd.to_numeric(parts[0], errors='coerce')
+        year = year.where(year >= 1911, year + 1911)
+        return pd.to_datetime(pd.DataFrame({
+            'year': year,
+            'month': pd.to_numeric(parts[1], errors='coerce'),
+            'day': pd.to_numeric(parts[2], errors='coerce'),
+        }), errors='coerce')
@@ -1,10 +1,12 @@
-import BondCalc
+from BondCalc import BondCalc
+
+bc = BondCalc()
 '''
 假設市場上一、二、三年期無風險即期利率分別為 3.7%、4.2%、4.8%， 計
 算一個三年期平價公債的殖利率。
 '''
 rs = [0.037, 0.042, 0.048]
-y = BondCalc.current_y(rs)
+y = bc.current_y(rs)
 
 
 '''
@@ -13,11 +15,11 @@ y = BondCalc.current_y(rs)
 利率。
 '''
 rs = [0.015]
-r_n = BondCalc.interest_rate(rs, rs[-1])
+r_n = bc.interest_rate(rs, rs[-1])
 rs = [0.015, 0.0175]
-r_n = BondCalc.interest_rate(rs, rs[-1])
+r_n = bc.interest_rate(rs, rs[-1])
 rs = [0.015, 0.0175, 0.01875]
-r_n = BondCalc.interest_rate(rs, rs[-1])
+r_n = bc.interest_rate(rs, rs[-1])
 
 
 '''
@@ -25,26 +27,26 @@ r_n = BondCalc.interest_rate(rs, rs[-1])
 利用反推法計算出一年半到三年的各期即期利率。
 '''
 rs = [0.052, 0.0535]
-r_n = BondCalc.interest_rate(rs, 0.055, 2)
+r_n = bc.interest_rate(rs, 0.055, 2)
 rs = rs + [r_n]
-r_n = BondCalc.interest_rate(rs, 0.058, 2)
+r_n = bc.interest_rate(rs, 0.058, 2)
 rs = rs + [r_n]
-r_n = BondCalc.interest_rate(rs, 0.062, 2)
+r_n = bc.interest_rate(rs, 0.062, 2)
 rs = rs + [r_n]
-r_n = BondCalc.interest_rate(rs, 0.066, 2)
+r_n = bc.interest_rate(rs, 0.066, 2)
 
 
 '''
 (b) 一個三年期零息公債的價格（每半年複利）應是多少？
 '''
 rs = [0.052, 0.0535]
-r_n = BondCalc.zero_price(0.0667, 6, 2)
+r_n = bc.zero_price(0.0667, 6, 2)
 
 '''
 (c) 一個兩年期，票面利率為 4.4%的公債價格為？
 '''
 rs = [0.052, 0.0535, 0.0551, 0.0582]
-p = BondCalc.price(rs, 0.044, 2, 100)
+p = bc.price(rs, 0.044, 2, 100)
 
 
 
@@ -53,12 +55,12 @@ p = BondCalc.price(rs, 0.044, 2, 100)
 年，票面利率為 8%，每年付息一次。請問此債券的到期殖利率為何？若此債
 券為每半年付息一次，則其到期殖利率又是多少？
 '''
-r = BondCalc.ytm(0.08, 7, 1, 101300, 100000)
+r = bc.ytm(0.08, 7, 1, 101300, 100000)
 
 '''
 若此債券為每半年付息一次，則其到期殖利率又是多少？
 '''
-r = BondCalc.ytm(0.08, 7, 2, 101300, 100000)
+r = bc.ytm(0.08, 7, 2, 101300, 100000)
 
 '''
 甲先生以 $101,400 購得面額 $100,000 之債券一張，該債券到期期限尚有四
@@ -68,7 +70,7 @@ r = BondCalc.ytm(0.08, 7, 2, 101300, 100000)
 '''
 # 投資期限報酬率
 rs = [0.04, 0.03, 0.025, 0.02]
-y = BondCalc.horizon_ytm(rs, 3, 0.03, 100000, 101400)
+y = bc.horizon_ytm(rs, 3, 0.03, 100000, 101400)
 
 '''
  假設一檔面額$100,000的債券，到期期限五年，票面利率8%，每年付息一次。
@@ -78,6 +80,6 @@ y = BondCalc.horizon_ytm(rs, 3, 0.03, 100000, 101400)
 '''
 # 投資期限報酬率
 fs = [0.07, 0.06, 0.05]
-y = BondCalc.horizon_ytm(fs, 3, 0.08, 100000, 103800, rs_to_fs=False)
+y = bc.horizon_ytm(fs, 3, 0.08, 100000, 103800, rs_to_fs=False)
 
 